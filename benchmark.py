@@ -0,0 +1,140 @@
+"""
+benchmark.py measures the cost of large problems
+
+A uniform N x N grid is built as in poisson2D.py, with two states
+per block, four fluxes per interior block, a constant source, and a
+layer of boundary blocks. For each size it reports
+
+  memory per cell:  bytes held by the blocks, their states, fluxes,
+    sources and parameters, divided by the number of interior blocks.
+    Objects shared between blocks (like parameter dictionaries used by
+    many fluxes, or state names) are counted once, and functions aren't
+    counted, as they are code and not data
+  setup:    seconds to build the blocks and the Problem
+  residual: seconds for one full residual evaluation
+  jacobian: seconds for one finite difference jacobian
+  jacobian bytes:   memory of the jacobian per cell, in double and
+    single precision (see Problem.solvePTC)
+
+Run with
+
+python benchmark.py N1 N2 ...
+
+where N are the grid sizes, defaulting to 32, 64 and 128
+
+"""
+import sys
+import time as clocktime
+from types import FunctionType, BuiltinFunctionType, MethodType, ModuleType
+from numpy import float32
+import src.blocks as b
+import src.flux as f
+import src.problem as p
+import src.source as s
+
+""" Fluxes defined here """
+def difference(B,N,P):
+  return dict((s,(N[s]-B[s])/P['d']) for s in B.state)
+
+"""
+grid:       builds the blocks of an N x N grid on [0,1]x[0,1]
+
+input(s):   (N) number of interior blocks in each direction
+output(s):  (interior blocks, boundary blocks)
+"""
+def grid(N):
+  d = 1./N
+  n = N+2
+  B = []
+  for i in range(-1,N+1):
+    for j in range(-1,N+1):
+      B.append(b.Block('('+str(i)+','+str(j)+')',
+        [('u',0.),('v',0.)],None,{'x':(i+0.5)*d,'y':(j+0.5)*d,'h':d}))
+  P = {'d':d*d}
+  for i in range(1,n-1):
+    for j in range(1,n-1):
+      for k in [(i-1)*n+j, i*n+j-1,(i+1)*n+j, i*n+j+1]:
+        B[i*n+j].addFlux(f.Flux(B[k],difference,P,vectorized=True))
+      B[i*n+j].addSource(s.Source(s.constant,{'u':1.,'v':-1.},
+        'constant',vectorized=True))
+  interior = [B[i*n+j] for i in range(1,n-1) for j in range(1,n-1)]
+  boundary = [B[i*n+j] for i in range(n) for j in range(n) \
+    if i in [0,n-1] or j in [0,n-1]]
+  return (interior,boundary)
+
+"""
+sizeof:     bytes held by objects, following references
+
+input(s):   (objects) list of objects
+output(s):  total size in bytes, each object counted once
+"""
+def sizeof(objects):
+  seen = set()
+  stack = list(objects)
+  total = 0
+  skip = (type,FunctionType,BuiltinFunctionType,MethodType,ModuleType)
+  while stack:
+    obj = stack.pop()
+    if id(obj) in seen or isinstance(obj,skip):
+      continue
+    seen.add(id(obj))
+    total += sys.getsizeof(obj)
+    if isinstance(obj,dict):
+      stack.extend(obj.keys())
+      stack.extend(obj.values())
+    elif isinstance(obj,(list,tuple,set,frozenset)):
+      stack.extend(obj)
+    if hasattr(obj,'__dict__'):
+      stack.append(obj.__dict__)
+    for cls in type(obj).__mro__:
+      for slot in cls.__dict__.get('__slots__',()):
+        if hasattr(obj,slot):
+          stack.append(getattr(obj,slot))
+  return total
+
+"""
+nbytes:     bytes held by a sparse matrix
+
+input(s):   (J) scipy.sparse csc or csr matrix
+output(s):  bytes of its values and indices
+"""
+def nbytes(J):
+  return J.data.nbytes+J.indices.nbytes+J.indptr.nbytes
+
+"""
+benchmark:  builds and evaluates an N x N grid
+
+input(s):   (N) grid size
+output(s):  dict with the number of cells, memory per cell in bytes,
+            setup, residual and jacobian times in seconds, and the
+            jacobian memory per cell in double and single precision
+"""
+def benchmark(N):
+  start = clocktime.time()
+  (interior,boundary) = grid(N)
+  problem = p.Problem(interior,boundary)
+  setup = clocktime.time()-start
+  memory = sizeof(interior+boundary)/float(len(interior))
+  U = problem.getSolutionVec()
+  start = clocktime.time()
+  problem.invalidate()
+  problem.r(U)
+  residual = clocktime.time()-start
+  start = clocktime.time()
+  J = problem.jacobianFD(U)
+  jacobian = clocktime.time()-start
+  single = problem.jacobianFD(U,dtype=float32)
+  return {'cells':len(interior),'memory':memory,'setup':setup,
+    'residual':residual,'jacobian':jacobian,
+    'jacobianMemory':(nbytes(J)/float(len(interior)),
+      nbytes(single)/float(len(interior)))}
+
+if __name__ == "__main__":
+  sizes = [int(N) for N in sys.argv[1:]] or [32,64,128]
+  print "%8s %16s %10s %10s %10s %16s" % \
+    ('cells','bytes per cell','setup','residual','jacobian','jacobian bytes')
+  for N in sizes:
+    r = benchmark(N)
+    print "%8d %16.0f %10.3f %10.3f %10.3f %7.0f /%7.0f" % (r['cells'],
+      r['memory'],r['setup'],r['residual'],r['jacobian'],
+      r['jacobianMemory'][0],r['jacobianMemory'][1])
@@ -66,7 +66,7 @@ def time(B,P):
 def difference(B,N,P):
   return dict((s,(N[s]-B[s])/P['d']) for s in B.state)
 
-def diffusion2D(N):
+def diffusion2D(N,method='odeint',**options):
   d = 2./float(N) # spacing, delta 
   # initialize with exact solution at t = 0
   B = []
@@ -90,7 +90,7 @@ def diffusion2D(N):
     for j in range(1,n-1):
       # Add fluxes, looping around the edges
       for k in [(i-1)*n+j, i*n+j-1,(i+1)*n+j, i*n+j+1]:
-        B[i*n+j].addFlux(f.Flux(B[k],difference,P))
+        B[i*n+j].addFlux(f.Flux(B[k],difference,P,vectorized=True))
 
   interiorBlocks = [B[i*n+j] for i in range(1,n-1) for j in range(1,n-1)]
 
@@ -110,7 +110,7 @@ def diffusion2D(N):
   # at each needed time.
   # solve the unstead problem at the following timesteps
   P = p.Problem(interiorBlocks,boundaryBlocks)
-  P.solveUnst(np.linspace(0,tf,10))
+  P.solveUnst(np.linspace(0,tf,10),method,**options)
   
   # calculate the error for accuracy checking
   Eu = 0
@@ -124,9 +124,9 @@ def diffusion2D(N):
 
   return (math.sqrt(Eu/(n-2)/(n-2)),math.sqrt(Ev)/(n-2)/(n-2))
 
-def test():
+def test(method='odeint',**options):
   n = 3
-  Error = [diffusion2D(n),diffusion2D(n*2)]
+  Error = [diffusion2D(n,method,**options),diffusion2D(n*2,method,**options)]
   Rate = [(math.log(Error[1][0])-math.log(Error[0][0]))/(math.log(2./(2*n))-math.log(2./(n))),
   (math.log(Error[1][1])-math.log(Error[0][1]))/(math.log(2./(2*n))-math.log(2./(n)))]
   return Rate
@@ -254,6 +254,54 @@ def implementationThree():
   print b1
   print b2
 
+"""
+This computes sensitivities of the first implementation,
+using the boundary source of the second implementation
+so that u_0 is also a parameter. The objective is a
+least squares fit to a measurement of u_2, as would be
+used to calibrate C_f, C_s and u_0. The gradient comes
+from one adjoint solve, and is checked by finite 
+differences, which need two solves per parameter
+"""
+def sensitivities(measured=0.2,h=1e-4):
+  # constants
+  u0 = 1.0
+  C_f = 1.0
+  C_s = 1.0
+
+  b1 = b.Block('1',{'u':0,'v':0})
+  b2 = b.Block('2',{'u':0})
+  F_P = {'C_f':C_f}
+  S_0P = {'C_f':C_f, 'u_0':u0}
+  S_uP = {'C_s':C_s}
+  b1.addFlux(f.Flux(b2,F_v))
+  b2.addFlux(f.Flux(b1,F_u,F_P,'f_u12'))
+  b1.addSource(s.Source(S_0,S_0P,'boundary'))
+  b1.addSource(s.Source(S_u,S_uP,'s_u1'))
+  b2.addSource(s.Source(S_u,S_uP,'s_u2'))
+  problem = p.Problem([b1,b2])
+
+  # the objective is a function of the global solution
+  # u_2 is the last unknown
+  def objective(U):
+    return (U[-1]-measured)**2
+
+  parameters = [(F_P,'C_f'),(S_uP,'C_s'),(S_0P,'u_0')]
+  problem.solve()
+  adjoint = problem.sensitivity(objective,parameters)
+
+  # finite differences, a solve for each perturbation
+  difference = []
+  for (P,key) in parameters:
+    J = []
+    for dp in [h,-h]:
+      P[key] += dp
+      problem.solve()
+      J.append(objective(problem.getSolutionVec()))
+      P[key] -= dp
+    difference.append((J[0]-J[1])/(2*h))
+  return (adjoint,difference)
+
 if __name__ == "__main__":
   implementationOne()
   implementationTwo()
@@ -40,13 +40,28 @@ import src.blocks as b
 import src.flux as f
 import src.problem as p
 import src.source as s
+import src.amr as amr
 
 
 """ Fluxes defined here """
 def difference(B,N,P):
   return dict((s,(N[s]-B[s])/P['d']) for s in B.state)
 
-def poisson2D(N):
+""" Sources defined here, -f['u'] and -f['v'] at the center of a block """
+def sources(block):
+  (x,y) = (block.p['x'],block.p['y'])
+  return [s.Source(s.constant, # standard function defined in source.py
+    {'u':-(x*x+y*y)*math.exp(x*y),
+    'v':-4.0*(x*x+y*y+1.0)*math.exp(x*x+y*y)}, # parameters
+    'constant', # name
+    vectorized=True)] # works with array valued states
+
+""" boundary blocks are set to the exact solution at their center """
+def exact(B,P):
+  (x,y) = (B.p['x'],B.p['y'])
+  return {'u':math.exp(x*y),'v':math.exp(x*x+y*y)}
+
+def poisson2D(N,method='fsolve',cycles=0,**options):
   """ 
   lets define a uniform square mesh on [-1, 1] x [1, 1]
   and create boundary blocks as we go,
@@ -67,14 +82,7 @@ def poisson2D(N):
         {'u':math.exp(x*y),
          'v':math.exp(x**2+y**2)}, # initialize to exact solution
          None, # no parameter functions
-         {'x':x,'y':y})) # parameter of coordinates
-  # interior sources, -f['u'] and -f['v']
-  for block in B:
-    (x,y) = (block.p['x'],block.p['y'])
-    block.addSource(s.Source(s.constant, # standard function defined in source.py
-      {'u':-(x*x+y*y)*math.exp(x*y),
-      'v':-4.0*(x*x+y*y+1.0)*math.exp(x*x+y*y)}, # parameters
-      'constant')) # name
+         {'x':x,'y':y,'h':d})) # parameter of coordinates, and cell width
 
   # Flux geometry 
   P = {'d':d*d} # divide by delta x^2 in the end
@@ -83,21 +91,36 @@ def poisson2D(N):
     for j in range(1,N+1):
       # Add fluxes, figuring out which neighbors to connect to
       for k in [(i-1)*n+j, i*n+j-1,(i+1)*n+j, i*n+j+1]:
-        B[i*n+j].addFlux(f.Flux(B[k],difference,P))
+        B[i*n+j].addFlux(f.Flux(B[k],difference,P,vectorized=True))
 
   interiorBlocks = [B[i*n+j] for i in range(1,N+1) for j in range(1,N+1)]
-
-  # solve the problem on the interior blocks
-  P = p.Problem(interiorBlocks)
-  P.solve()
+  boundaryBlocks = [B[i*n+j] for i in range(0,n) for j in range(0,n) \
+    if i in [0,n-1] or j in [0,n-1]]
+  # interior sources, and boundary blocks set to the exact solution
+  for block in interiorBlocks:
+    for source in sources(block):
+      block.addSource(source)
+  for block in boundaryBlocks:
+    block.addSource(s.Source(exact,None,'exact'))
+
+  # solve the problem on the interior blocks,
+  # with the boundary blocks, so they can follow any refinement
+  P = p.Problem(interiorBlocks,boundaryBlocks)
+  if cycles == 0:
+    P.solve(method=method,**options)
+  else:
+    # refine the quarter of the blocks with the largest jumps, each cycle
+    amr.solveAdaptive(P,cycles,sources=sources,method=method,**options)
   # compute the L-2 error against the exact solution for both variables
-  Eu = math.sqrt(sum([(math.exp(block.p['x']*block.p['y'])-block['u'])**2 for block in interiorBlocks])/(n-2)/(n-2))
-  Ev = math.sqrt(sum([(math.exp(block.p['x']**2+block.p['y']**2)-block['v'])**2 for block in interiorBlocks])/(n-2)/(n-2))
+  # weighted by the area of each block, as they may have been refined
+  A = sum([block.p['h']**2 for block in P.b])
+  Eu = math.sqrt(sum([block.p['h']**2*(math.exp(block.p['x']*block.p['y'])-block['u'])**2 for block in P.b])/A)
+  Ev = math.sqrt(sum([block.p['h']**2*(math.exp(block.p['x']**2+block.p['y']**2)-block['v'])**2 for block in P.b])/A)
   return (Eu,Ev)
 
-def test():
+def test(method='fsolve',**options):
   n = 3
-  Error = [poisson2D(n),poisson2D(n*2)]
+  Error = [poisson2D(n,method,**options),poisson2D(n*2,method,**options)]
   # do a quick check of convergence rate of error, should be > 2
   Rate = [(math.log(Error[1][0])-math.log(Error[0][0]))/(math.log(2./(2*n))-math.log(2./(n))),
   (math.log(Error[1][1])-math.log(Error[0][1]))/(math.log(2./(2*n))-math.log(2./(n)))]
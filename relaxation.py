@@ -0,0 +1,71 @@
+"""
+Solve T*u_t = nu*u_xx - u on [0,1], with u = 0 at both ends
+on a uniform grid of N blocks
+
+for initial condition
+u = sin(pi*x)
+
+T is 1 in most blocks, and much smaller in the fast ones, so the
+time scales of the blocks can be far apart, as multirate is meant for.
+The decay source can be tagged stiff=False, so imex and strang treat
+it explicitly, and only the diffusion is implicit.
+
+There is no exact solution once T varies, so the accuracy is
+estimated from the solutions with m, 2m and 4m steps,
+and should be around 2 if the integrator is performing correctly.
+
+"""
+import math as math
+import src.blocks as b
+import src.flux as f
+import src.problem as p
+import src.source as s
+import numpy as np
+
+N = 8
+tf = 1
+
+""" Fluxes defined here """
+def difference(B,N,P):
+  return dict((s,(N[s]-B[s])/P['d']) for s in B.state)
+
+def fast(B):
+  return {'u':1e-2}
+
+"""
+relaxation: solves with m steps of the output times
+
+input(s):   (m) number of intervals of the output times
+            (method) transient method, see Problem.solveUnst
+            (nu) diffusivity
+            (fastBlocks) indices of the blocks with a small T
+            (stiff) stiffness tag of the decay source
+output(s):  final global solution
+"""
+def relaxation(m,method='multirate',nu=1./64,fastBlocks=(),stiff=True,
+  **options):
+  d = 1./N
+  B = []
+  for i in range(-1,N+1):
+    x = i*d+d/2
+    u = math.sin(math.pi*x) if 0 <= i < N else 0.
+    B.append(b.Block(str(i),{'u':u},None,{'x':x}))
+
+  P = {'d':d*d/nu}
+  for i in range(1,N+1):
+    for k in [i-1,i+1]:
+      B[i].addFlux(f.Flux(B[k],difference,P,vectorized=True))
+    B[i].addSource(s.Source(s.linear,{'u':-1.},'decay',vectorized=True,
+      stiff=stiff))
+    if i-1 in fastBlocks:
+      B[i].T = fast
+  for k in [0,N+1]:
+    B[k].addSource(s.Source(s.constant,{'u':0.},B[k].name))
+
+  problem = p.Problem(B[1:N+1],[B[0],B[N+1]])
+  return np.array(problem.solveUnst(np.linspace(0,tf,m+1),method,
+    **options).solution)
+
+def test(method='multirate',m=16,**options):
+  U = [relaxation(m*2**k,method,**options) for k in range(3)]
+  return math.log(abs(U[1]-U[0]).max()/abs(U[2]-U[1]).max(),2)
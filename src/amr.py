@@ -0,0 +1,444 @@
+"""
+amr.py contains adaptive mesh refinement for grids of blocks
+
+This works with 2D cartesian grids, like the one in poisson2D.py,
+where each block is a square cell, with its geometry in its parameters
+  (.p['x'], .p['y']) the center of the cell
+  (.p['h']) the width of the cell
+
+Refining a block splits it into four children, with states interpolated
+from the parent using a gradient estimated from its neighbors. The fluxes
+of the parent (and those pointing to it) are rewired to the children
+touching each neighbor, using the parent's fluxes as templates.
+Each child remembers its parent in .p['parent'], so four children can be
+merged back into their parent when coarsening.
+
+Cells can have neighbors of different sizes, so new fluxes have their
+geometry set as a two point flux through the shared face, by default
+  P['d'] = (distance between centers)*(area of the cell)/(face length)
+so that (N[s]-B[s])/P['d'], as in poisson2D.py, is the flux through
+the face per unit area. On a uniform grid this is the spacing squared.
+
+Where the centers of the two cells are not lined up across the face
+(between cells of different sizes), the values of the block the flux 
+belongs to are first moved along the face to the line through the 
+neighbor's center, using the block's gradient. This keeps the flux
+consistent, and only depends on the block's own neighbors.
+
+Boundary blocks, in problem.bc, with the same geometry, are split along
+with the blocks they touch, so the boundary is always as fine as the
+blocks next to it. Their states are set by their sources, as usual.
+
+"""
+from sys import exit
+from collections import OrderedDict
+from .blocks import Block, internParameters
+from .flux import Flux
+from .source import Source
+
+"""
+geometry:   default flux parameters between two touching cells
+
+input(s):   (B) block the flux belongs to
+            (N) neighboring block
+            (face) length of the shared face
+output(s):  dictionary of flux parameters
+"""
+def geometry(B,N,face):
+  return {'d':0.5*(B.p['h']+N.p['h'])*B.p['h']*B.p['h']/face}
+
+"""
+face:       the face shared by two cells
+
+input(s):   (B,N) blocks
+output(s):  (length of the shared face, 0 if they don't touch,
+             (x,y) offset of N's center from B's along the face)
+"""
+def face(B,N):
+  if N.p is None or 'h' not in N.p:
+    return (0.,(0.,0.))
+  (xb,yb,hb) = (B.p['x'],B.p['y'],B.p['h'])
+  (xn,yn,hn) = (N.p['x'],N.p['y'],N.p['h'])
+  gap = 0.5*(hb+hn)
+  eps = 1e-9*min(hb,hn)
+  if abs(abs(xb-xn)-gap) < eps:
+    overlap = min(yb+hb/2,yn+hn/2)-max(yb-hb/2,yn-hn/2)
+    offset = (0.,yn-yb)
+  elif abs(abs(yb-yn)-gap) < eps:
+    overlap = min(xb+hb/2,xn+hn/2)-max(xb-hb/2,xn-hn/2)
+    offset = (xn-xb,0.)
+  else:
+    return (0.,(0.,0.))
+  if abs(offset[0])+abs(offset[1]) < eps:
+    offset = (0.,0.)
+  return (overlap,offset) if overlap > eps else (0.,(0.,0.))
+
+"""
+indicator:  error indicator of a block
+
+input(s):   (B) block
+output(s):  largest jump in any state across the block's fluxes
+
+neighboring values are differences of the solution across the flux
+graph, so this is large where the solution changes quickly
+"""
+def indicator(B):
+  jumps = [abs(F.N[s]-B[s]) for F in B.F for s in B.state if s in F.N.state]
+  return max(jumps) if jumps else 0.
+
+"""
+estimate:   error indicators for every block in a problem
+
+input(s):   (problem) Problem
+output(s):  list of indicators, in the order of problem.b
+"""
+def estimate(problem):
+  return [indicator(B) for B in problem.b]
+
+"""
+gradient:   least squares gradient of the states of a block
+
+input(s):   (B) block
+output(s):  dict of (d/dx, d/dy) for each state
+
+fit to the neighbors through the fluxes which have the state
+"""
+def gradient(B):
+  g = {}
+  for s in B.state:
+    (axx,axy,ayy,bx,by) = (0.,0.,0.,0.,0.)
+    for F in B.F:
+      N = F.N
+      if s not in N.state or N.p is None or 'x' not in N.p:
+        continue
+      (dx,dy,du) = (N.p['x']-B.p['x'],N.p['y']-B.p['y'],N[s]-B[s])
+      (axx,axy,ayy) = (axx+dx*dx,axy+dx*dy,ayy+dy*dy)
+      (bx,by) = (bx+dx*du,by+dy*du)
+    det = axx*ayy-axy*axy
+    if det > 1e-12*(axx+ayy)**2:
+      g[s] = ((ayy*bx-axy*by)/det,(axx*by-axy*bx)/det)
+    else:
+      g[s] = (0.,0.)
+  return g
+
+"""
+_Shifted:   stands in for a block, with its states moved by an offset
+
+input(s):   (B) block
+            (offset) (x,y) distance to move the states by
+output(s):  None
+
+has the same attributes flux functions use from a block
+"""
+class _Shifted(object):
+  def __init__(self,B,offset):
+    g = gradient(B)
+    self.name = B.name
+    self.state = OrderedDict([(s,B[s]+g[s][0]*offset[0]+g[s][1]*offset[1])\
+      for s in B.state])
+    (self.P,self.p,self.t,self.F,self.S) = (B.P,B.p,B.t,B.F,B.S)
+
+  def __getitem__(self,key):
+    return self.state[key]
+
+"""
+shifted:    flux function for cells which are not lined up across a face
+
+input(s):   (B) Block
+            (N) Neighboring block
+            (P) Parameters, with the original flux function in P['flux']
+              and the offset along the face in P['offset']
+output(s):  the original flux, with B's states moved along the face
+"""
+def shifted(B,N,P):
+  return P['flux'](_Shifted(B,P['offset']),N,P)
+
+"""
+_into:      index of the fluxes pointing into each block
+
+input(s):   (problem) Problem
+output(s):  dict from id(block) to a list of the fluxes into it
+"""
+def _into(problem):
+  into = {}
+  for D in problem.b+problem.bc:
+    for F in D.F:
+      into.setdefault(id(F.N),[]).append(F)
+  return into
+
+"""
+_parameters: table of the flux parameters of a problem, for 
+             blocks.internParameters
+
+input(s):   (problem) Problem
+output(s):  dict from the contents of each dictionary to the dictionary
+"""
+def _parameters(problem):
+  table = {}
+  for D in problem.b+problem.bc:
+    for F in D.F:
+      internParameters(F.P,table)
+  return table
+
+"""
+link:       adds a flux from B to N if the cells touch
+
+input(s):   (B,N) blocks
+            (template) flux to copy the function, parameters and name from
+            (geometry) function giving the geometric flux parameters
+            (into) index of fluxes into each block, kept up to date
+            (table) table of parameters to intern the new parameters in,
+              see blocks.internParameters, None not to share them
+output(s):  None
+
+with a table, fluxes across equal faces share their parameters
+"""
+def link(B,N,template,geometry=geometry,into=None,table=None):
+  (length,offset) = face(B,N)
+  if length > 0:
+    P = dict(template.P) if template.P is not None else {}
+    f = P.pop('flux') if template.F is shifted else template.F
+    P.pop('offset',None)
+    P.update(geometry(B,N,length))
+    if offset != (0.,0.):
+      P.update({'flux':f,'offset':offset})
+      f = shifted
+    if table is not None:
+      P = internParameters(P,table)
+    F = Flux(N,f,P,template.name,template.vectorized,template.stiff)
+    B.addFlux(F)
+    if into is not None:
+      into.setdefault(id(N),[]).append(F)
+
+"""
+_sources:   sources for a new block
+
+input(s):   (B) new block
+            (old) block whose sources are copied, if sources is None
+            (sources) function returning a list of Sources for a block
+output(s):  None
+"""
+def _sources(B,old,sources):
+  if sources is not None:
+    for S in sources(B):
+      B.addSource(S)
+  else:
+    for S in old.S:
+      B.addSource(Source(S.S,S.P,S.name,S.vectorized,S.stiff))
+
+"""
+_check:     makes sure a block can be refined
+
+input(s):   (B) block
+output(s):  None
+"""
+def _check(B):
+  if B.p is None or not all([k in B.p for k in ['x','y','h']]):
+    exit("block "+B.name+" needs x, y and h parameters to be refined")
+  if not B.F:
+    exit("block "+B.name+" needs a flux to be refined")
+
+"""
+split:      creates the four children of a block
+
+input(s):   (B) block
+output(s):  list of child blocks, without fluxes or sources
+
+child states are linearly interpolated from B using its gradient
+"""
+def split(B):
+  g = gradient(B)
+  h = B.p['h']/2.
+  children = []
+  for (k,(dx,dy)) in enumerate([(-1,-1),(-1,1),(1,-1),(1,1)]):
+    (dx,dy) = (dx*h/2.,dy*h/2.)
+    p = dict(B.p)
+    p.update({'x':B.p['x']+dx,'y':B.p['y']+dy,'h':h,'parent':B,
+      'level':B.p.get('level',0)+1})
+    C = Block(B.name+'.'+str(k),
+      [(s,B[s]+g[s][0]*dx+g[s][1]*dy) for s in B.state],B.P,p,B.t)
+    C.T = B.T
+    children.append(C)
+  return children
+
+"""
+_replace:   swaps a block for its children in the flux graph
+
+input(s):   (B) block
+            (children) blocks replacing it, without fluxes or sources
+            (into) index of fluxes into each block, kept up to date
+            (sources, geometry) as in refine
+            (table) table of parameters of the problem, see link
+output(s):  None
+
+B keeps its own fluxes, so it can be restored later
+"""
+def _replace(B,children,into,sources,geometry,table):
+  for C in children:
+    for F in B.F:
+      link(C,F.N,F,geometry,into,table)
+    for D in children:
+      if D is not C and B.F:
+        link(C,D,B.F[0],geometry,into,table)
+    _sources(C,B,sources)
+  for F in B.F:
+    into[id(F.N)].remove(F)
+  for F in into.pop(id(B),[]):
+    F.B.removeFlux(F)
+    for C in children:
+      link(F.B,C,F,geometry,into,table)
+
+"""
+refine:     splits blocks in a problem into their children
+
+input(s):   (problem) Problem
+            (blocks) list of blocks in the problem to refine
+            (sources) function returning a list of Sources for a new block,
+              by default the sources of the parent are copied
+            (geometry) function giving the geometric flux parameters
+output(s):  list of new blocks
+
+the parents are replaced by their children in the problem.
+Boundary blocks (problem.bc) coarser than a block touching them are
+split as well, their children copy their sources, which set their states,
+and replace them in problem.bc. New fluxes with equal parameters
+share them, within the problem
+"""
+def refine(problem,blocks,sources=None,geometry=geometry):
+  into = _into(problem)
+  table = _parameters(problem)
+  new = []
+  for B in blocks:
+    _check(B)
+    children = split(B)
+    _replace(B,children,into,sources,geometry,table)
+    new.extend(children)
+  # boundaries follow the refinement
+  boundary = dict((id(G),G) for G in problem.bc)
+  queue = [F.N for C in new for F in C.F if id(F.N) in boundary]
+  (bc,removed) = ([],set())
+  while queue:
+    G = queue.pop()
+    if id(G) not in boundary or \
+      all([F.B.p['h'] >= G.p['h'] for F in into.get(id(G),[])]):
+      continue
+    children = split(G)
+    _replace(G,children,into,None,geometry,table)
+    del boundary[id(G)]
+    removed.add(id(G))
+    for C in children:
+      boundary[id(C)] = C
+      queue.append(C)
+    bc.extend(children)
+  problem.bc[:] = [G for G in problem.bc+bc if id(G) not in removed]
+  problem.removeBlocks([B.name for B in blocks])
+  problem.addBlocks(new)
+  return new
+
+"""
+coarsen:    merges children back into their parents
+
+input(s):   (problem) Problem
+            (blocks) list of blocks in the problem which can be merged
+            (sources) function returning a list of Sources for a new block,
+              by default the parent keeps the sources it had
+            (geometry) function giving the geometric flux parameters
+output(s):  list of merged parents
+
+only merges when all four children of a parent are in blocks,
+the parent takes the average of their states. Boundary blocks 
+stay as they are
+"""
+def coarsen(problem,blocks,sources=None,geometry=geometry):
+  families = {}
+  for B in blocks:
+    if B.p is not None and 'parent' in B.p:
+      families.setdefault(id(B.p['parent']),[]).append(B)
+  into = _into(problem)
+  table = _parameters(problem)
+  merged = []
+  removed = []
+  for children in families.values():
+    if len(children) != 4:
+      continue
+    parent = children[0].p['parent']
+    for s in children[0].state:
+      parent[s] = sum([C[s] for C in children])/4.
+    parent.t = children[0].t
+    parent.F[:] = []
+    parent.touch()
+    if sources is not None:
+      parent.S[:] = []
+      _sources(parent,None,sources)
+    family = set([id(C) for C in children])
+    # the family's neighbors, outside of it, in both directions
+    (outward,inward) = ([],[])
+    for C in children:
+      for F in C.F:
+        into[id(F.N)].remove(F)
+        if id(F.N) not in family and all([F.N is not N for N,G in outward]):
+          outward.append((F.N,F))
+    for C in children:
+      for F in into.pop(id(C),[]):
+        if id(F.B) not in family:
+          F.B.removeFlux(F)
+          if all([F.B is not D for D,G in inward]):
+            inward.append((F.B,F))
+    for (N,F) in outward:
+      link(parent,N,F,geometry,into,table)
+    for (D,F) in inward:
+      link(D,parent,F,geometry,into,table)
+    merged.append(parent)
+    removed.extend([C.name for C in children])
+  problem.removeBlocks(removed)
+  problem.addBlocks(merged)
+  return merged
+
+"""
+adapt:      one cycle of refinement and coarsening
+
+input(s):   (problem) Problem, solved
+            (refineFraction) fraction of blocks, with the largest 
+              indicators, to refine
+            (coarsenFraction) fraction of blocks, with the smallest
+              indicators, to try merging
+            (sources, geometry) as in refine
+            (maxLevel) blocks at this level are not refined further
+output(s):  (number of blocks refined, number of parents merged)
+"""
+def adapt(problem,refineFraction=0.25,coarsenFraction=0.,sources=None,\
+  geometry=geometry,maxLevel=None):
+  e = estimate(problem)
+  order = sorted(range(len(e)),key=lambda i:e[i])
+  (nf,nc) = (int(refineFraction*len(e)),int(coarsenFraction*len(e)))
+  fine = [problem.b[i] for i in order[len(e)-nf:] if nf > 0 and e[i] > 0 \
+    and (maxLevel is None or problem.b[i].p.get('level',0) < maxLevel)]
+  merged = coarsen(problem,[problem.b[i] for i in order[:nc]],sources,geometry)
+  # blocks which were just merged away can't be refined
+  names = set([B.name for B in problem.b])
+  fine = [B for B in fine if B.name in names]
+  refine(problem,fine,sources,geometry)
+  return (len(fine),len(merged))
+
+"""
+solveAdaptive:  solves, adapts and resolves from the interpolated solution
+
+input(s):   (problem) Problem
+            (cycles) number of adaptation cycles
+            (tol) stop early once every indicator is below this
+            (method, options) passed on to problem.solve
+            remaining inputs as in adapt
+output(s):  list of the number of unknowns after each solve
+"""
+def solveAdaptive(problem,cycles=3,refineFraction=0.25,coarsenFraction=0.,\
+  tol=None,sources=None,geometry=geometry,maxLevel=None,method='fsolve',\
+  **options):
+  problem.solve(method=method,**options)
+  unknowns = [len(problem.mapping)]
+  for c in range(cycles):
+    if tol is not None and max(estimate(problem)) < tol:
+      break
+    adapt(problem,refineFraction,coarsenFraction,sources,geometry,maxLevel)
+    problem.solve(method=method,**options)
+    unknowns.append(len(problem.mapping))
+  return unknowns
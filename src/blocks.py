@@ -23,7 +23,14 @@ Each Block has:
     Sources and Fluxes do not need to be ordered 
     since they are never explicitly globally unwrapped
   (.t) time
-  (.T) Time function, returns dict of coefficient on time terms
+  (.T) Time function, returns dict of coefficient on time terms,
+    by default unitTime, shared by all blocks
+  (.version) topology version, counts changes to the states,
+    fluxes and sources of the block. Block.topology counts
+    changes over all blocks, so a Problem can cheaply tell if
+    any of its blocks have changed, and Block.written counts
+    the states set in any block, so it can tell if states were
+    set by hand
 
 The equation for the block is
 R(state) = Sum(Fluxes(state)) + Sum(Sources(state)) = 0
@@ -32,9 +39,154 @@ d/d(state) = R(state)
 
 All blocks are connected through fluxes, defined in flux.py
 
+Large meshes have many blocks, so Blocks (and Fluxes and Sources) use
+__slots__ rather than a dictionary of attributes per object. The state 
+of a block is a State, an ordered mapping which keeps the values in a 
+list, and the names in a Schema shared by every block with the same 
+states. Equal parameter dictionaries can be shared with
+internParameters.
 
 """
-from collections import OrderedDict
+from collections import OrderedDict, Mapping, MutableMapping
+
+class Schema(object):
+  """
+  Schema Class, the ordered state names of blocks
+
+  get:        the shared schema for some state names
+
+  input(s):   (names) sequence of state names
+  output(s):  Schema, the same object for the same names
+
+  Each Schema has:
+    (.names) tuple of state names
+    (.index) dict from state name to its position
+  """
+  __slots__ = ('names','index')
+  _schemas = {}
+
+  def __init__(self,names):
+    self.names = names
+    self.index = dict((k,i) for i,k in enumerate(names))
+
+  @classmethod
+  def get(cls,names):
+    names = tuple(names)
+    if names not in cls._schemas:
+      cls._schemas[names] = cls(names)
+    return cls._schemas[names]
+
+class State(object):
+  """
+  State Class, the physical state of a block
+
+  __init__:   State Constructor
+
+  input(s):   (initial) dictionary or list of (name, value) pairs
+  output(s):  None
+
+  behaves as an ordered dictionary of states, adding or removing
+  states moves it to the schema for its new names, setting a state
+  counts in Block.written. The rest of the dictionary interface, 
+  (update, pop, setdefault, iteritems, ==, ...) comes from 
+  MutableMapping, it is registered as one rather than derived from it,
+  as deriving from it gives every State a __dict__ in python 2
+  """
+  __slots__ = ('schema','_values')
+  __hash__ = None
+
+  def __init__(self,initial=()):
+    items = list(initial.items()) if hasattr(initial,'items') \
+      else list(initial)
+    self.schema = Schema.get([k for k,v in items])
+    self._values = [v for k,v in items]
+
+  def __getitem__(self,key):
+    return self._values[self.schema.index[key]]
+
+  def __setitem__(self,key,val):
+    Block.written += 1
+    i = self.schema.index.get(key)
+    if i is None:
+      self.schema = Schema.get(self.schema.names+(key,))
+      self._values.append(val)
+    else:
+      self._values[i] = val
+
+  def __delitem__(self,key):
+    i = self.schema.index[key]
+    self.schema = Schema.get(self.schema.names[:i]+self.schema.names[i+1:])
+    del self._values[i]
+
+  def __contains__(self,key):
+    return key in self.schema.index
+
+  def __iter__(self):
+    return iter(self.schema.names)
+
+  def __len__(self):
+    return len(self._values)
+
+  def keys(self):
+    return list(self.schema.names)
+
+  def values(self):
+    return list(self._values)
+
+  def items(self):
+    return list(zip(self.schema.names,self._values))
+
+  def get(self,key,default=None):
+    i = self.schema.index.get(key)
+    return default if i is None else self._values[i]
+
+  def copy(self):
+    return State(self.items())
+
+  def __repr__(self):
+    return "State("+repr(self.items())+")"
+
+for name in ['pop','popitem','clear','update','setdefault']:
+  setattr(State,name,MutableMapping.__dict__[name])
+for name in ['iterkeys','itervalues','iteritems','__eq__','__ne__']:
+  setattr(State,name,Mapping.__dict__[name])
+MutableMapping.register(State)
+
+"""
+unitTime:   default time function, a coefficient of 1 on every state
+
+input(s):   (B) Block
+output(s):  dict of coefficients on the time terms
+"""
+def unitTime(B):
+  return dict([(s,1) for s in B.state])
+
+"""
+internParameters: shares equal parameter dictionaries
+
+input(s):   (P) dictionary of parameters
+            (table) dict of the dictionaries interned so far, kept by the
+              caller, so that dictionaries are only shared within one
+              mesh or problem
+output(s):  a dictionary equal to P, the same object for every
+            equal dictionary interned in the table before
+
+saves memory when many fluxes or sources are given equal parameters,
+changing an interned dictionary changes it for all of them, and it is
+no longer handed out for its old contents.
+Dictionaries with unhashable values are returned as they are
+"""
+def internParameters(P,table):
+  if P is None:
+    return P
+  try:
+    key = frozenset(P.items())
+  except TypeError:
+    return P
+  shared = table.setdefault(key,P)
+  if shared is not P and shared != P:
+    table[key] = shared = P
+  return shared
 
 class Block(object):
   """ 
@@ -52,33 +204,57 @@ class Block(object):
 
   output(s):  None
   """
+  __slots__ = ('name','state','P','p','F','S','t','T','version')
+  topology = 0
+  written = 0
 
   def __init__(self,name,initial,parameterFunctions=None,\
     parameters=None,t=0):
     self.name = name
-    self.state = OrderedDict(initial)
+    self.state = State(initial)
     self.P = parameterFunctions
     self.p = parameters
     self.F = []
     self.S = [] 
     self.t = t
-    self.T = lambda B : dict([(s,1) for s in B.state])
+    self.T = unitTime
+    self.version = 0
 
   """
   These overload the [] operator, such that the 
   states can be set much more easily
 
+  setting a state that doesn't exist adds it, changing the topology
   """
   def __getitem__(self,key):
     return self.state[key]
 
   def __setitem__(self,key,val):
+    if key not in self.state:
+      self.touch()
     self.state[key] = val
+
+  def removeState(self,key):
+    del self.state[key]
+    self.touch()
+
+  """
+  touch:     marks the topology of the block as changed
+
+  input(s):  None
+  output(s): None
+
+  called by anything that adds or removes states, fluxes or sources
+  """
+  def touch(self):
+    self.version += 1
+    Block.topology += 1
   """
   addFlux:
   addSource: Block Setup Functions
 
   input(s):  (F,S) Flux objects, Source objects
+             or for removal, their name or the object itself
   output(s): None
 
   these functions don't add anything new, but make
@@ -88,28 +264,34 @@ class Block(object):
   def addFlux(self,F):
     self.F.append(F)
     F.B = self
+    self.touch()
 
   def removeFlux(self,name):
-    self.F[:] = [F for F in self.F if F.name != name]
+    self.F[:] = [F for F in self.F if F.name != name and F is not name]
+    self.touch()
 
   def addSource(self,S):
     self.S.append(S)
     S.B = self
+    self.touch()
 
   def removeSource(self,name):
-    self.S[:] = [S for S in self.S if S.name != name]
+    self.S[:] = [S for S in self.S if S.name != name and S is not name]
+    self.touch()
 
   """
   R: Residual function
 
-  input(s):  None
+  input(s):  (stiff) None for the full residual, True or False
+             for only the stiff or non-stiff fluxes and sources
   output(s): dict of states and residuals corresponding to state
 
   sums over sources and fluxes to calculate the residual
   """
-  def R(self):
+  def R(self,stiff=None):
     R = OrderedDict([(s,0) for s in self.state])
-    for d in [F.flux() for F in self.F]+[S.source() for S in self.S]:
+    for d in [F.flux() for F in self.F if stiff in (None,F.stiff)]+\
+      [S.source() for S in self.S if stiff in (None,S.stiff)]:
       for s in d:
         R[s] += d[s]
     return R
@@ -27,6 +27,19 @@ u1_flux = Flux(u2,fluxFunction,{'dx':1},'u_flux')
 
 u1.addFlux(u1_flux)
 
+Flux functions written with operations that also work on numpy arrays,
+like the one above, can be flagged with vectorized=True. Problem.rBatch
+then evaluates them once with each state holding an array of values,
+one per state vector, instead of once per state vector.
+
+Fluxes are stiff by default, fluxes which are cheap and slow, such as
+advection, can be flagged with stiff=False, so the IMEX and splitting
+integrators in integrators.py treat them explicitly.
+
+Fluxes use __slots__, as there are several for every block.
+Fluxes with equal parameters can share the dictionary, using
+blocks.internParameters.
+
 """
 
 class Flux(object):
@@ -39,15 +52,21 @@ class Flux(object):
               (f) Flux function name
               (P) Parameters
               (name) identifying name
+              (vectorized) True if f works with array valued states
+              (stiff) False if the flux can be treated explicitly
 
   output(s):  None
   """
-  def __init__(self,N,f,P=None,name=''):
+  __slots__ = ('B','N','F','P','name','vectorized','stiff')
+
+  def __init__(self,N,f,P=None,name='',vectorized=False,stiff=True):
     self.B = None # this will be set when its added to the block
     self.N = N
     self.F = f 
     self.P = P
     self.name = name
+    self.vectorized = vectorized
+    self.stiff = stiff
 
   """
   The following is a wrapper for flux function choices defined with
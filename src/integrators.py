@@ -0,0 +1,454 @@
+"""
+integrators.py contains time integrators for transient problems
+
+These work on the unsteady residual of a Problem,
+  T dU/dt = R(U), or dU/dt = rUnst(U,t)
+and are used through Problem.solveUnst
+
+  implicitEuler:  backward euler, with newton's method and a sparse
+    finite difference jacobian, cheap and stable for large steps
+  parareal:       time parallel integration, splitting the output
+    times into slices, with a cheap coarse propagator (implicitEuler)
+    run serially, and the accurate fine propagator (odeint) run
+    on each slice in parallel over a process pool
+  imex:           implicit-explicit Runge-Kutta, ARS(2,2,2), the stiff
+    fluxes and sources are implicit, the rest are explicit
+  strang:         Strang splitting, half steps of the non-stiff part
+    (explicit, Heun's method) around a step of the stiff part (SDIRK2)
+
+  multirate:      multirate explicit integration (Heun's method), blocks
+    are grouped by their local time scale, from T and the diagonal of 
+    the jacobian, and each group takes as many substeps as it needs
+    per interval of the output times, so slow blocks are evaluated
+    much less often than fast ones. Blocks next to a faster group
+    take its substeps too. Groups are advanced fastest first, the
+    faster neighbors of a group are interpolated across the interval,
+    and the slower ones extrapolated from their rates at the start of it
+
+For imex and strang, fluxes and sources are tagged with stiff=False
+if they are non-stiff (see flux.py), everything else is stiff. Only the
+stiff part needs the jacobian, which has no entries for the non-stiff
+fluxes, and it is factored once and reused for several steps.
+Both are second order.
+
+"""
+from math import ceil, sqrt, exp
+from multiprocessing import Pool, cpu_count
+from scipy.sparse import identity, diags
+from scipy.sparse.linalg import spsolve, factorized
+from numpy import array, vstack, absolute, zeros, inf
+from numpy.linalg import norm
+
+"""
+implicitEuler:  backward euler steps of the unsteady problem
+
+input(s):   (problem) Problem
+            (U) global array of states at t0
+            (t0, t1) initial and final time
+            (steps) number of equal steps to take
+            (newton) maximum newton iterations per step
+            (tol) relative tolerance of the newton iterations
+output(s):  global array of states at t1
+
+each step solves U - U_0 - dt*rUnst(U,t) = 0, with the jacobian
+I - dt*diag(1/T)*J computed once per step and reused for the iterations
+"""
+def implicitEuler(problem,U,t0,t1,steps=1,newton=5,tol=1e-8):
+  dt = float(t1-t0)/steps
+  U = array(U,dtype=float)
+  I = identity(len(U),format='csc')
+  for k in range(steps):
+    t = t0+(k+1)*dt
+    V = U.copy()
+    A = None
+    for it in range(newton):
+      g = V-U-dt*array(problem.rUnst(V,t))
+      if norm(g) <= tol*(1.+norm(V)):
+        break
+      if A is None:
+        J = problem.jacobianFD(V)
+        A = (I-dt*diags(1./problem.timeVec(),0)*J).tocsc()
+      V = V-spsolve(A,g)
+    U = V
+  return U
+
+"""
+_problem:   the problem being integrated by parareal, it is set
+            before the process pool starts, so each process gets
+            its own copy when forked, rather than pickling it
+_fine:      fine propagator, run in the process pool
+_worker:    starts each process of the pool, dropping its copy of the
+            result of the solve, so the work there isn't reported to
+            a copy which would stop the solve on its own count
+
+input(s):   (U, t, hmax) initial states, times for the slice, largest step
+output(s):  2D array of states at each time in the slice
+"""
+_problem = None
+
+def _fine(args):
+  (U,t,hmax) = args
+  return _problem.propagate(U,t,hmax)
+
+def _worker():
+  _problem._result = None
+
+"""
+parareal:   time parallel integration of a transient problem
+
+input(s):   (problem) Problem
+            (t) array of output times
+            (slices) number of time slices, defaults to processes
+            (processes) size of the process pool, defaults to cpu count
+              with one process, the fine propagators run in this process
+            (coarseSteps) implicit euler steps per slice for the coarse
+              propagator
+            (tol) relative change in the slice interfaces to converge to
+            (iterations) maximum number of parareal iterations, at
+              most the number of slices are needed, which is exactly
+              serial
+output(s):  2D array of states at each time in t, as from odeint
+
+each iteration runs the fine propagator from every slice interface
+in parallel, then corrects the interfaces serially with
+  U_n+1 = G(U_n) + F(U_n old) - G(U_n old)
+with a process pool, the residual evaluations of the fine propagators
+happen in the other processes, so they aren't counted in .nfev or the
+iteration budget of the solve, nor seen by its callback, and the time
+budget is only checked between them
+"""
+def parareal(problem,t,slices=None,processes=None,coarseSteps=1,\
+  tol=1e-4,iterations=None):
+  global _problem
+  if processes is None:
+    processes = cpu_count()
+  if slices is None:
+    slices = max(processes,2)
+  slices = max(1,min(slices,len(t)-1))
+  if iterations is None:
+    iterations = slices
+  hmax = (t[-1]-t[0])/len(t)
+  # slice boundaries, as indices of t, each slice shares its end points
+  edges = [int(round(n*(len(t)-1)/float(slices))) for n in range(slices+1)]
+  U = [array(problem.getSolutionVec(),dtype=float)]
+  for n in range(slices):
+    U.append(implicitEuler(problem,U[n],t[edges[n]],t[edges[n+1]],coarseSteps))
+  G = U[1:]
+
+  _problem = problem
+  pool = Pool(processes,_worker) if processes > 1 else None
+  try:
+    for k in range(iterations):
+      tasks = [(U[n],t[edges[n]:edges[n+1]+1],hmax) for n in range(slices)]
+      fine = pool.map(_fine,tasks) if pool is not None else map(_fine,tasks)
+      fine = list(fine)
+      # serial correction of the interfaces, the first slice is exact
+      change = 0.
+      for n in range(slices):
+        if n == 0:
+          Unew = fine[0][-1]
+        else:
+          Gnew = implicitEuler(problem,U[n],t[edges[n]],t[edges[n+1]],\
+            coarseSteps)
+          Unew = Gnew+fine[n][-1]-G[n]
+          G[n] = Gnew
+        change = max(change,norm(Unew-U[n+1])/max(norm(U[n+1]),1.))
+        U[n+1] = Unew
+      if change < tol:
+        break
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+    _problem = None
+  return vstack([fine[0]]+[f[1:] for f in fine[1:]])
+
+"""
+_stiffStage:  solves an implicit stage of the stiff part
+              V = rhs + a*fS(V,t), fS = rUnstSplit(V,t,True)
+
+input(s):   (problem) Problem
+            (rhs) global array, the explicit part of the stage
+            (t) time of the stage
+            (a) coefficient on the stiff part, the step times the
+              diagonal of the scheme
+            (solve) solves with I - a*diag(1/T)*J, for the stiff jacobian J
+            (newton) maximum newton iterations
+            (tol) relative tolerance of the newton iterations
+output(s):  global array, the stage
+"""
+def _stiffStage(problem,rhs,t,a,solve,newton,tol):
+  V = rhs.copy()
+  for it in range(newton):
+    g = V-rhs-a*problem.rUnstSplit(V,t,True)
+    if norm(g) <= tol*(1.+norm(V)):
+      break
+    V = V-solve(g)
+  return V
+
+"""
+_Factors:   factored matrices for the implicit stages, reused
+            while the coefficient stays the same, for some steps
+
+input(s):   (problem) Problem
+            (age) number of steps a factorization is reused for
+output(s):  None
+
+called with (U,t,a), the states and time the stiff jacobian is
+taken at and the coefficient on the stiff part, returns a function
+solving I - a*diag(1/T)*J
+"""
+class _Factors(object):
+  def __init__(self,problem,age):
+    self.problem = problem
+    self.age = age
+    self.a = None
+    self.count = 0
+
+  def __call__(self,U,t,a):
+    if a != self.a or self.count >= self.age:
+      problem = self.problem
+      problem.updateUnst(t)
+      J = problem.jacobianFD(U,None,True)
+      I = identity(len(U),format='csc')
+      self.solve = factorized((I-a*diags(1./problem.timeVec(),0)*J).tocsc())
+      (self.a,self.count) = (a,0)
+    self.count += 1
+    return self.solve
+
+# diagonal coefficient of ARS(2,2,2) and SDIRK2, and the explicit weight
+_gamma = 1.-1./sqrt(2.)
+_delta = 1.-1./(2.*_gamma)
+
+"""
+_imexStep:    one ARS(2,2,2) step
+_strangStep:  one Strang splitting step
+
+input(s):   (problem) Problem
+            (U) global array of states at t
+            (t) time
+            (h) step
+            (fN) function of (U,t) giving the non-stiff part
+            (factor) _Factors
+            (newton, tol) for the implicit stages
+output(s):  global array of states at t+h
+"""
+def _imexStep(problem,U,t,h,fN,factor,newton,tol):
+  (g,d) = (_gamma,_delta)
+  solve = factor(U,t,g*h)
+  fN1 = fN(U,t)
+  U2 = _stiffStage(problem,U+g*h*fN1,t+g*h,g*h,solve,newton,tol)
+  fN2 = fN(U2,t+g*h)
+  fS2 = problem.rUnstSplit(U2,t+g*h,True)
+  return _stiffStage(problem,U+h*(d*fN1+(1-d)*fN2)+h*(1-g)*fS2,\
+    t+h,g*h,solve,newton,tol)
+
+def _strangStep(problem,U,t,h,fN,factor,newton,tol):
+  g = _gamma
+  # half step of the non-stiff part
+  k = fN(U,t)
+  V = U+0.5*h*k
+  U = U+0.25*h*(k+fN(V,t+0.5*h))
+  # full step of the stiff part
+  solve = factor(U,t,g*h)
+  U1 = _stiffStage(problem,U,t+g*h,g*h,solve,newton,tol)
+  fS1 = problem.rUnstSplit(U1,t+g*h,True)
+  U = _stiffStage(problem,U+h*(1-g)*fS1,t+h,g*h,solve,newton,tol)
+  # half step of the non-stiff part
+  k = fN(U,t+0.5*h)
+  V = U+0.5*h*k
+  return U+0.25*h*(k+fN(V,t+h))
+
+"""
+imex:       integrates with IMEX Runge-Kutta steps
+strang:     integrates with Strang splitting steps
+
+input(s):   (problem) Problem
+            (t) array of output times
+            (dt) largest step, defaults to a tenth of the spacing of t,
+              each interval of t is split into equal steps no larger
+            (newton, tol) for the implicit stages
+            (jacobianAge) number of steps the factored stiff jacobian
+              is reused for, newton iterations make up for it
+              if the stiff part is nonlinear
+output(s):  2D array of states at each time in t, as from odeint
+"""
+def imex(problem,t,dt=None,newton=5,tol=1e-8,jacobianAge=10):
+  return _march(problem,t,_imexStep,dt,newton,tol,jacobianAge)
+
+def strang(problem,t,dt=None,newton=5,tol=1e-8,jacobianAge=10):
+  return _march(problem,t,_strangStep,dt,newton,tol,jacobianAge)
+
+def _march(problem,t,step,dt,newton,tol,jacobianAge):
+  if dt is None:
+    dt = 0.1*(t[-1]-t[0])/(len(t)-1)
+  factor = _Factors(problem,jacobianAge)
+  # skip the non-stiff part if everything is stiff
+  if any([not F.stiff for B in problem.b for F in B.F]+\
+    [not S.stiff for B in problem.b for S in B.S]):
+    fN = lambda U,t: problem.rUnstSplit(U,t,False)
+  else:
+    fN = lambda U,t: 0.
+  U = array(problem.getSolutionVec(),dtype=float)
+  soln = [U]
+  for j in range(len(t)-1):
+    steps = max(1,int(ceil((t[j+1]-t[j])/dt-1e-9)))
+    h = float(t[j+1]-t[j])/steps
+    for k in range(steps):
+      U = step(problem,U,t[j]+k*h,h,fN,factor,newton,tol)
+    soln.append(U)
+  return vstack(soln)
+
+"""
+_timeScales:  local time scale of each block, the smallest |T/J_ii| 
+              of its unknowns, for the jacobian diagonal J_ii
+
+input(s):   (problem) Problem
+            (U) global array of states
+            (t) time
+output(s):  list of time scales, inf for blocks that don't change
+"""
+def _timeScales(problem,U,t):
+  problem.updateUnst(t)
+  D = absolute(problem.jacobianFD(U).diagonal())
+  T = absolute(problem.timeVec())
+  tau = [inf]*len(problem.b)
+  for ix,(i,k) in enumerate(problem.mapping):
+    if D[ix] > 0:
+      tau[i] = min(tau[i],T[ix]/D[ix])
+  return tau
+
+class _Level(object):
+  """
+  _Level:     a group of blocks taking the same number of substeps
+
+  input(s):   (problem) Problem
+              (blocks) indices of the blocks in the group
+              (substeps) number of substeps per interval
+              (neighbors) for each block, the blocks its residual uses
+              (rows) for each block, its global indices and states
+  output(s):  None
+
+  (.halo) global indices and states of the blocks outside the group
+    its residuals use, (.haloBlocks) those blocks
+  (.boundaries) the boundary blocks its residuals use
+  only these are updated when the rates of the group are evaluated
+  """
+  def __init__(self,problem,blocks,substeps,neighbors,rows):
+    self.blocks = blocks
+    self.substeps = substeps
+    self.rows = [r for i in blocks for r in rows[i]]
+    self.unknowns = [ix for ix,k in self.rows]
+    outside = sorted(set().union(*[neighbors[i] for i in blocks])-set(blocks))
+    self.halo = [r for j in outside for r in rows[j]]
+    self.haloBlocks = [problem.b[j] for j in outside]
+    boundaries = set([id(bc) for bc in problem.bc])
+    self.boundaries = list(dict((id(F.N),F.N) for i in blocks \
+      for F in problem.b[i].F if id(F.N) in boundaries).values())
+
+  """
+  rates:      dU/dt of the unknowns of the group
+
+  input(s):   (problem) Problem
+              (Y) states of the group
+              (t) time
+              (other) function of (global index, t) giving the
+                states of blocks outside the group
+  output(s):  array of rates, in the order of .unknowns
+  """
+  def rates(self,problem,Y,t,other):
+    problem.report(t=t)
+    for B in self.haloBlocks+self.boundaries:
+      B.t = t
+    for bc in self.boundaries:
+      for s in bc.state:
+        bc[s] = sum([S.source()[s] for S in bc.S])
+    for ix,k in self.halo:
+      problem.b[problem.mapping[ix][0]][k] = other(ix,t)
+    for (ix,k),y in zip(self.rows,Y):
+      problem.b[problem.mapping[ix][0]][k] = y
+    rates = []
+    for i in self.blocks:
+      B = problem.b[i]
+      B.t = t
+      (R,T) = (B.R(),B.T(B))
+      rates.extend([R[s]/T[s] for s in B.state])
+    return array(rates)
+
+"""
+multirate:  integrates with multirate Heun's method
+
+input(s):   (problem) Problem
+            (t) array of output times, each interval is a macro step
+            (cfl) substeps are taken no larger than cfl times the
+              local time scale of the block
+            (maxRatio) largest number of substeps per macro step,
+              a power of two
+output(s):  2D array of states at each time in t, as from odeint
+
+blocks are regrouped at the start of each interval of t, and take
+1, 2, 4 ... substeps per interval, or those of their fastest neighbor
+if it takes more. Without that, a fast block relaxing within the
+interval is only seen by its slow neighbors at the ends of it, and
+the method drops to first order. Explicit, so blocks with the largest
+ratio still need cfl times their time scale to be no smaller than the
+interval over maxRatio
+"""
+def multirate(problem,t,cfl=0.5,maxRatio=1024):
+  dependents = problem.dependents()
+  neighbors = [set() for B in problem.b]
+  for j,D in enumerate(dependents):
+    for i in D:
+      neighbors[i].add(j)
+  rows = [[] for B in problem.b]
+  for ix,(i,k) in enumerate(problem.mapping):
+    rows[i].append((ix,k))
+  U = array(problem.getSolutionVec(),dtype=float)
+  soln = [U]
+  for j in range(len(t)-1):
+    (t0,H) = (t[j],float(t[j+1]-t[j]))
+    problem._U = None
+    groups = {}
+    scales = _timeScales(problem,U,t0)
+    substeps = []
+    for tau in scales:
+      m = 1
+      while m < maxRatio and H > m*cfl*tau:
+        m *= 2
+      substeps.append(m)
+    # blocks next to faster ones step with them, as their rates follow
+    # states which may change a lot within the interval, even though
+    # their own don't, and the slower groups then only see smooth ones
+    for i,m in enumerate(substeps):
+      m = max([substeps[j] for j in neighbors[i]]+[m])
+      groups.setdefault(m,[]).append(i)
+    tau = array([scales[i] for i,k in problem.mapping])
+    problem._U = None
+    f0 = array(problem.rUnst(U,t0))
+    new = U.copy()
+    done = zeros(len(U),dtype=bool)
+    # blocks already advanced are interpolated, the others extrapolated,
+    # relaxing over their time scale, which is linear for slow blocks
+    def other(ix,time):
+      if done[ix]:
+        return U[ix]+(time-t0)/H*(new[ix]-U[ix])
+      if tau[ix] == inf:
+        return U[ix]+(time-t0)*f0[ix]
+      return U[ix]+f0[ix]*tau[ix]*(1.-exp(-(time-t0)/tau[ix]))
+    for m in sorted(groups.keys(),reverse=True):
+      level = _Level(problem,groups[m],m,neighbors,rows)
+      h = H/m
+      Y = U[level.unknowns]
+      k1 = f0[level.unknowns]
+      for n in range(m):
+        time = t0+n*h
+        k2 = level.rates(problem,Y+h*k1,time+h,other)
+        Y = Y+0.5*h*(k1+k2)
+        if n < m-1:
+          k1 = level.rates(problem,Y,time+h,other)
+      new[level.unknowns] = Y
+      done[level.unknowns] = True
+    U = new
+    soln.append(U)
+  problem._U = None
+  return vstack(soln)
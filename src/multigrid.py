@@ -0,0 +1,414 @@
+"""
+multigrid.py contains the Multigrid class
+
+This is a geometric multigrid solver for grid structured problems,
+like poisson2D.py and diffusion2D.py, where each block is a square cell
+with its geometry in its parameters, as in amr.py
+  (.p['x'], .p['y']) the center of the cell
+  (.p['h']) the width of the cell
+
+Each coarser level is built by aggregating 2x2 squares of neighboring
+blocks, connected through their fluxes, into a block of twice the width.
+The coarse blocks get their fluxes by copying the fine fluxes between
+aggregates (with the geometry from amr.py), and copies of the sources of
+one of their members. Boundary blocks are coarsened along with each
+level, the ones next to each coarse block merge into one, lined up with
+it, and as far from the edge as the fine boundary blocks, so every
+coarse block has one flux per face, and the boundary condition stays
+where it was. Other blocks outside the problem are shared by all levels.
+Coarsening stops when the blocks can no longer be grouped in complete
+squares, or there are few enough of them.
+
+Nonlinear problems are handled with the full approximation scheme (FAS),
+each level solves A(u) = f, where on the finest level A(u) = R(U), f = 0
+and on coarser levels
+  f = A(restricted u) + restricted (f - A(u)) from the finer level
+so anything that doesn't depend on the states (such as constant sources)
+cancels out, and the coarse sources only need to be approximate.
+
+States and residuals are restricted by averaging over each aggregate,
+corrections are prolonged by linear interpolation using a least squares
+gradient of the correction on the coarse level. Each level is smoothed
+by nonlinear multicolor Gauss-Seidel, using the diagonal of the jacobian,
+and the coarsest level is solved with newton's method.
+
+"""
+from sys import exit
+from math import floor
+from collections import OrderedDict
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import spsolve
+from numpy import array, zeros
+from numpy.linalg import norm
+from .blocks import Block
+from .source import Source
+from . import amr
+
+"""
+aggregate:  groups blocks into 2x2 squares
+
+input(s):   (blocks) list of blocks with x, y and h parameters
+output(s):  list of lists of 4 blocks, or None if they can't be grouped
+
+every block needs the same width and states, and each group has to be
+connected through fluxes between its members
+"""
+def aggregate(blocks):
+  if not blocks:
+    return None
+  for B in blocks:
+    if B.p is None or not all([k in B.p for k in ['x','y','h']]):
+      exit("block "+B.name+" needs x, y and h parameters for multigrid")
+  h = blocks[0].p['h']
+  states = list(blocks[0].state.keys())
+  if any([abs(B.p['h']-h) > 1e-9*h or list(B.state.keys()) != states \
+    for B in blocks]):
+    return None
+  groups = _cells(blocks,blocks)
+  groups = list(groups.values())
+  for group in groups:
+    if len(group) != 4:
+      return None
+    for B in group:
+      if not any([F.N is C for F in B.F for C in group if C is not B]):
+        return None
+  return groups
+
+"""
+aggregateBoundaries: groups the boundary blocks of a level into the
+                     boundary blocks of the coarse level
+
+input(s):   (blocks) list of blocks of the level, grouped by aggregate
+            (boundaries) list of boundary blocks of the level
+output(s):  list of lists of boundary blocks, one per coarse boundary 
+            block, or None if the boundary blocks don't all have the
+            same width and states
+
+only boundary blocks with fluxes from the level are grouped, by the 
+cell of twice the width of the level they fall in, on the same grid as 
+aggregate, so the coarse boundary blocks line up with the coarse blocks.
+Their width is kept, it is their distance from the edge
+"""
+def aggregateBoundaries(blocks,boundaries):
+  used = set([id(F.N) for B in blocks for F in B.F])
+  boundaries = [G for G in boundaries if id(G) in used]
+  if not boundaries:
+    return []
+  for G in boundaries:
+    if G.p is None or not all([k in G.p for k in ['x','y','h']]):
+      return None
+  h = boundaries[0].p['h']
+  states = list(boundaries[0].state.keys())
+  if any([abs(G.p['h']-h) > 1e-9*h or list(G.state.keys()) != states \
+    for G in boundaries]):
+    return None
+  return list(_cells(blocks,boundaries).values())
+
+"""
+_cells:     groups blocks by the cell of twice the width of a level
+            they fall in
+
+input(s):   (blocks) list of blocks of the level, of the same width
+            (members) list of blocks to group
+output(s):  OrderedDict from the (i,j) index of each cell to the list
+            of its members
+"""
+def _cells(blocks,members):
+  h = blocks[0].p['h']
+  x0 = min([B.p['x'] for B in blocks])-h/2.
+  y0 = min([B.p['y'] for B in blocks])-h/2.
+  groups = OrderedDict()
+  for B in members:
+    key = (int(floor((B.p['x']-x0)/(2*h))),int(floor((B.p['y']-y0)/(2*h))))
+    groups.setdefault(key,[]).append(B)
+  return groups
+
+"""
+coarsen:    builds the coarse blocks for a list of aggregates
+_merge:     builds one coarse block at the center of a group, averaging
+            its states and copying the sources of its first member
+_boundary:  flux parameters between a coarse block and a coarse boundary
+            block, whose width is its distance from the edge, instead of
+            the length of the face they share
+
+input(s):   (groups) list of lists of blocks, from aggregate
+            (level) number of the coarse level, used to name blocks
+            (boundaries) list of lists of boundary blocks, 
+              from aggregateBoundaries
+            (group, name, h) group, name of the block, and its width
+            (B, N, face) as for amr.geometry
+output(s):  (list of coarse blocks, in the order of groups,
+             list of coarse boundary blocks, in the order of boundaries)
+"""
+def coarsen(groups,level,boundaries=[]):
+  coarse = []
+  owner = {}
+  for k,group in enumerate(groups):
+    C = _merge(group,'multigrid'+str(level)+':'+str(k),2*group[0].p['h'])
+    coarse.append(C)
+    for G in group:
+      owner[id(G)] = C
+  bc = []
+  for k,group in enumerate(boundaries):
+    C = _merge(group,'multigrid'+str(level)+':bc'+str(k),group[0].p['h'])
+    bc.append(C)
+    for G in group:
+      owner[id(G)] = C
+  edge = set([id(C) for C in bc])
+  # equal flux parameters are shared within the level
+  table = {}
+  for C,group in zip(coarse,groups):
+    linked = set([id(C)])
+    for G in group:
+      for F in G.F:
+        N = owner.get(id(F.N),F.N)
+        if id(N) not in linked:
+          amr.link(C,N,F,_boundary if id(N) in edge else amr.geometry,\
+            None,table)
+          linked.add(id(N))
+  return (coarse,bc)
+
+def _boundary(B,N,face):
+  return {'d':0.5*(B.p['h']+N.p['h'])*B.p['h']}
+
+def _merge(group,name,h):
+  B = group[0]
+  p = dict(B.p)
+  p.pop('parent',None)
+  p.update({'x':sum([G.p['x'] for G in group])/float(len(group)),
+    'y':sum([G.p['y'] for G in group])/float(len(group)),'h':h})
+  C = Block(name,[(s,sum([G[s] for G in group])/float(len(group))) \
+    for s in B.state],B.P,p,B.t)
+  C.T = B.T
+  for S in B.S:
+    C.addSource(Source(S.S,S.P,S.name,S.vectorized,S.stiff))
+  return C
+
+class Multigrid(object):
+  """
+  Multigrid Class
+
+  __init__:   builds the hierarchy of levels
+
+  input(s):   (problem) the finest level
+              (coarsest) stop coarsening at or below this many blocks
+              (maxLevels) largest number of levels
+  output(s):  None
+
+  Each level has:
+    (.levels) list of Problems, finest first
+    (.restrictions) matrices averaging level i onto level i+1
+    (.prolongations) matrices interpolating level i+1 onto level i
+    (.colors) groups of blocks smoothed together, on each level
+    (.rows) global index and state of the unknowns of each block
+    (.D) jacobian diagonals used for smoothing on each level
+    (.version) topology version of the finest problem when built
+  """
+  def __init__(self,problem,coarsest=16,maxLevels=10):
+    self.levels = [problem]
+    self.restrictions = []
+    self.prolongations = []
+    self.version = problem.version
+    while len(self.levels) < maxLevels and \
+      len(self.levels[-1].b) > coarsest:
+      fine = self.levels[-1]
+      groups = aggregate(fine.b)
+      if groups is None:
+        break
+      boundaries = aggregateBoundaries(fine.b,fine.bc)
+      (blocks,bc) = coarsen(groups,len(self.levels),boundaries or [])
+      # boundaries which can't be coarsened are shared with the fine level
+      coarse = type(problem)(blocks,bc if boundaries is not None else fine.bc)
+      self.restrictions.append(self._restriction(fine,coarse,groups))
+      self.prolongations.append(self._prolongation(fine,coarse,groups))
+      self.levels.append(coarse)
+    self.colors = [self._colors(level) for level in self.levels]
+    self.rows = [self._rows(level) for level in self.levels]
+    self.D = [None]*len(self.levels)
+
+  """
+  _restriction:   averaging matrix from a fine level to the coarse level
+  _prolongation:  linear interpolation from the coarse level to the fine
+
+  input(s):   (fine,coarse) Problems
+              (groups) aggregates of fine blocks, one per coarse block
+  output(s):  scipy.sparse csr matrix
+
+  the interpolation uses the least squares gradient of the coarse
+  values with its neighbors, neighbors outside the problem are
+  boundaries, which have no correction
+  """
+  def _restriction(self,fine,coarse,groups):
+    index = dict(((i,k),ix) for ix,(i,k) in enumerate(fine.mapping))
+    position = dict((id(B),i) for i,B in enumerate(fine.b))
+    rows, cols, vals = [], [], []
+    for ix,(i,k) in enumerate(coarse.mapping):
+      for G in groups[i]:
+        rows.append(ix)
+        cols.append(index[(position[id(G)],k)])
+        vals.append(0.25)
+    return csr_matrix((vals,(rows,cols)),\
+      shape=(len(coarse.mapping),len(fine.mapping)))
+
+  def _prolongation(self,fine,coarse,groups):
+    index = dict(((i,k),ix) for ix,(i,k) in enumerate(coarse.mapping))
+    position = dict((id(B),i) for i,B in enumerate(coarse.b))
+    owner = dict((id(G),j) for j,group in enumerate(groups) for G in group)
+    rows, cols, vals = [], [], []
+    for ix,(i,k) in enumerate(fine.mapping):
+      G = fine.b[i]
+      j = owner[id(G)]
+      C = coarse.b[j]
+      # neighbors of C, and the least squares weights for the gradient
+      neighbors = [F.N for F in C.F if k in F.N.state]
+      d = [(N.p['x']-C.p['x'],N.p['y']-C.p['y']) for N in neighbors]
+      (axx,axy,ayy) = (sum([a*a for a,b in d]),sum([a*b for a,b in d]),
+        sum([b*b for a,b in d]))
+      det = axx*ayy-axy*axy
+      (dx,dy) = (G.p['x']-C.p['x'],G.p['y']-C.p['y'])
+      weight = 1.
+      if det > 1e-12*(axx+ayy)**2:
+        for N,(a,b) in zip(neighbors,d):
+          w = (dx*(ayy*a-axy*b)+dy*(axx*b-axy*a))/det
+          weight -= w
+          if id(N) in position:
+            rows.append(ix)
+            cols.append(index[(position[id(N)],k)])
+            vals.append(w)
+      rows.append(ix)
+      cols.append(index[(j,k)])
+      vals.append(weight)
+    return csr_matrix((vals,(rows,cols)),\
+      shape=(len(fine.mapping),len(coarse.mapping)))
+
+  """
+  smooth:     nonlinear multicolor Gauss-Seidel
+
+  input(s):   (level) index of the level
+              (u) current solution of the level
+              (f) right hand side of the level
+              (sweeps) number of sweeps
+              (D) diagonal of the jacobian of the level
+  output(s):  smoothed solution
+
+  blocks of the same color don't have fluxes with each other, so they 
+  are updated together, block by block, one residual per block per sweep
+  """
+  def smooth(self,level,u,f,sweeps,D):
+    problem = self.levels[level]
+    problem.update(u)
+    for sweep in range(sweeps):
+      for group in self.colors[level]:
+        for i in group:
+          B = problem.b[i]
+          R = B.R()
+          for ix,k in self.rows[level][i]:
+            B[k] = B[k]-(R[k]-f[ix])/D[ix]
+    return array(problem.getSolutionVec(),dtype=float)
+
+  """
+  _colors:    groups of blocks with no fluxes between them
+  _rows:      global index and state of each block's unknowns
+
+  input(s):   (problem) Problem
+  output(s):  list of lists of block indices, list of lists of (index,state)
+  """
+  def _colors(self,problem):
+    dependents = problem.dependents()
+    neighbors = [set() for B in problem.b]
+    for j,D in enumerate(dependents):
+      for i in D:
+        neighbors[i].add(j)
+    colors = [-1]*len(problem.b)
+    groups = []
+    for i in range(len(problem.b)):
+      used = set([colors[j] for j in dependents[i] | neighbors[i]])
+      c = 0
+      while c in used:
+        c += 1
+      colors[i] = c
+      if c == len(groups):
+        groups.append([])
+      groups[c].append(i)
+    return groups
+
+  def _rows(self,problem):
+    rows = [[] for B in problem.b]
+    for ix,(i,k) in enumerate(problem.mapping):
+      rows[i].append((ix,k))
+    return rows
+
+  """
+  solveCoarsest:  newton's method on the coarsest level
+
+  input(s):   (u) current solution of the level
+              (f) right hand side of the level
+              (tol) residual norm to converge to
+              (maxiter) maximum number of newton steps
+  output(s):  solution
+  """
+  def solveCoarsest(self,u,f,tol,maxiter=10):
+    problem = self.levels[-1]
+    for k in range(maxiter):
+      r = problem.rVec(u)-f
+      if norm(r) < tol:
+        break
+      u = u-spsolve(problem.jacobianFD(u,r+f).tocsc(),r)
+    return u
+
+  """
+  cycle:      one FAS V-cycle
+
+  input(s):   (level) index of the level
+              (u) current solution of the level
+              (f) right hand side of the level
+              (pre, post) number of smoothing sweeps before and after
+              (tol) residual norm the coarsest level is solved to
+              (refresh) recompute the jacobian diagonal for smoothing,
+                otherwise the one from the first cycle is kept
+  output(s):  new solution of the level
+  """
+  def cycle(self,level,u,f,pre=2,post=2,tol=1e-10,refresh=False):
+    if level == len(self.levels)-1:
+      return self.solveCoarsest(u,f,tol)
+    problem = self.levels[level]
+    if refresh or self.D[level] is None:
+      self.D[level] = problem.jacobianFD(u).diagonal()
+    D = self.D[level]
+    u = self.smooth(level,u,f,pre,D)
+    r = f-self.levels[level].rVec(u)
+    uc = self.restrictions[level]*u
+    fc = self.levels[level+1].rVec(uc)+self.restrictions[level]*r
+    ec = self.cycle(level+1,uc.copy(),fc,pre,post,tol,refresh)-uc
+    u = u+self.prolongations[level]*ec
+    return self.smooth(level,u,f,post,D)
+
+  """
+  solve:      V-cycles until the residual of the finest level converges
+
+  input(s):   (tol) residual norm to converge to
+              (maxiter) maximum number of cycles
+              (pre, post) number of smoothing sweeps before and after
+              (refresh) recompute the smoothing diagonal every cycle,
+                for strongly nonlinear problems
+  output(s):  list of residual norms, one per cycle
+
+  the blocks of the finest level are left at the solution, and
+  (.converged) is set if the residual norm reached tol. Each cycle
+  is reported to the finest Problem, see Problem.report
+  """
+  def solve(self,tol=1e-8,maxiter=50,pre=2,post=2,refresh=False):
+    problem = self.levels[0]
+    self.D = [None]*len(self.levels)
+    u = array(problem.getSolutionVec(),dtype=float)
+    f = zeros(len(u))
+    residuals = [norm(problem.rVec(u))]
+    for k in range(maxiter):
+      if residuals[-1] < tol:
+        break
+      u = self.cycle(0,u,f,pre,post,tol*1e-2,refresh)
+      residuals.append(norm(problem.rVec(u)))
+      problem.report(residuals[-1],u)
+    problem.update(u)
+    self.converged = residuals[-1] < tol
+    return residuals
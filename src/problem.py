@@ -4,14 +4,39 @@ problem.py contains the Problem Class
 Each Problem has:
   (.b) a list of the blocks to solve for in the problem
   (.bc) a list of the blocks used as boundary blocks
-  (.mapping) the mapping between the local and global systems
+  (.mapping) the mapping between the local and global systems, a list
+    of (block index, state), brought up to date with the blocks
+    whenever it is used
   (._band) a pair (a,b) corresponding to the known bandedness of 
     the problem, if the matrix structure of the global problem is known
     This depends a lot on the order of the list of blocks
     if specified, this can speed up fsolve by orders of magnitude
+  (.version) topology version, counts changes to blocks, states and fluxes
+  (._offset) start of each block's states in the global system
+  (._neighbors) for each block, the blocks its residual depends on
+  (._dependents) for each block, the blocks whose residuals depend on it
+  (._pattern) cached sparsity pattern of the jacobian, built from the fluxes
+  (._colors) cached column grouping for finite difference jacobians
+  (.residuals) residual norm history of the last pseudo-transient solve
+  (._result) SolveResult of the running solve, see report
+  (._U, ._R) solution and residual of the last call to r, so that only
+    blocks affected by changed unknowns are recomputed on the next call,
+    within a solve or a finite difference jacobian, see _cache
+  (._caching) depth of the solves and jacobians using the cache
+  (._written) Block.written after the last call to r, if any state has
+    been set since, the cache is dropped
+  (._users) (version, for each boundary block, the blocks with fluxes
+    to it), see _boundaryUsers
+  (._jacobian) (version, precision, jacobian) of the last pseudo-transient
+    solve, which the next one starts with, see solvePTC
+
+Sensitivities of objectives of the solution, with respect to the
+parameters of blocks, fluxes and sources, are found with the discrete 
+adjoint, see sensitivity
 
 This class solves R(U) = F(U,U_N) + S(U) = 0
-by assembling the global system and solving it with fsolve
+by assembling the global system and solving it with fsolve,
+solves return a SolveResult, see result.py
 
 """
 
@@ -21,9 +46,19 @@ ode is used for solving transient
 """
 from scipy.optimize import fsolve
 from scipy.integrate import odeint
+from scipy.sparse import csc_matrix, diags
+from scipy.sparse.linalg import spsolve, factorized
 from collections import OrderedDict
 from sys import exit
-from numpy import array
+import time as clocktime
+from numpy import array, absolute, maximum, nonzero, isfinite, finfo, ones, \
+  float32, asarray, \
+  zeros, concatenate
+from numpy.linalg import norm
+from .blocks import Block
+from .multigrid import Multigrid
+from .integrators import parareal, imex, strang, multirate
+from .result import SolveResult, SolveAborted
 try:
   from numdifftools import nd
   JACOBIAN = True
@@ -42,18 +77,207 @@ class Problem(object):
   output(s):  None
   """
   def __init__(self,blocks,boundaries = [],**parameters):
-    self.b = blocks
+    # copies, as blocks are added and removed in place
+    self.b = list(blocks)
     # uniqueness in block names is required
     namelist = set([b.name for b in blocks])
     if(len(namelist) != len(blocks)):
       exit("multiple blocks have the same name")
 
-    self.bc = boundaries
-    self.mapping = [(i, k) for i, b in enumerate(blocks) \
-      for k in b.state.keys()]
+    self.bc = list(boundaries)
+    self.version = 0
 
     # Bandedness (default to None)
     self._band = None
+    self.residuals = []
+    # residual cache
+    self._U = None
+    self._R = None
+    self._caching = 0
+    self._written = Block.written
+    self._dirty = set()
+    self._users = None
+    self._multigrid = None
+    self._jacobian = None
+    self._result = None
+    self._build()
+
+  """
+  _build:     builds the mapping and block connectivity from scratch
+  _remap:     rebuilds the mapping, when states are added or removed
+  _coupled:   set of block indices the residual of block i depends on
+  mapping:    the mapping, after bringing it up to date with the blocks
+
+  input(s):   None, (i) block index
+  output(s):  None, set of block indices, list of (block index, state)
+  """
+  def _build(self):
+    self._index = dict((id(b),i) for i,b in enumerate(self.b))
+    self._versions = [b.version for b in self.b]
+    self._topology = Block.topology
+    self._neighbors = [self._coupled(i) for i in range(len(self.b))]
+    self._dependents = [set() for b in self.b]
+    for i,coupled in enumerate(self._neighbors):
+      for j in coupled:
+        self._dependents[j].add(i)
+    self._remap()
+
+  def _remap(self):
+    self._mapping = [(i, k) for i, b in enumerate(self.b) \
+      for k in b.state.keys()]
+    self._offset = [0]
+    for b in self.b:
+      self._offset.append(self._offset[-1]+len(b.state))
+    self._pattern = None
+    self._colors = None
+    self._U = None
+
+  def _coupled(self,i):
+    return set([i]+[self._index[id(F.N)] for F in self.b[i].F \
+      if id(F.N) in self._index])
+
+  @property
+  def mapping(self):
+    self._sync()
+    return self._mapping
+
+  """
+  _sync:      brings derived data up to date with the blocks
+
+  input(s):   None
+  output(s):  None
+
+  only does work if some block has changed since the last call,
+  then for each changed block, the mapping is rebuilt if its states
+  changed, and its connectivity, the sparsity pattern and the column 
+  groups are patched if its fluxes changed. The residual of a changed 
+  block is recomputed on the next call to r
+  """
+  def _sync(self):
+    if self._topology == Block.topology:
+      return
+    self._topology = Block.topology
+    changed = [i for i,b in enumerate(self.b) if b.version != self._versions[i]]
+    if not changed:
+      return
+    self.version += 1
+    remap = False
+    recolor = set()
+    for i in changed:
+      self._versions[i] = self.b[i].version
+      keys = [k for j,k in self._mapping[self._offset[i]:self._offset[i+1]]]
+      if keys != list(self.b[i].state.keys()):
+        remap = True
+      coupled = self._coupled(i)
+      if coupled != self._neighbors[i]:
+        for j in self._neighbors[i] - coupled:
+          self._dependents[j].discard(i)
+        for j in coupled - self._neighbors[i]:
+          self._dependents[j].add(i)
+        self._neighbors[i] = coupled
+        recolor |= coupled
+        self._pattern = None
+        self._band = None
+      self._dirty.add(i)
+    if remap:
+      self._remap()
+    elif self._colors is not None:
+      self._recolor(recolor)
+
+  """
+  addBlock:     adds a block to the problem
+  addBlocks:    adds a list of blocks
+  removeBlock:  removes a block from the problem, by name
+  removeBlocks: removes a list of blocks by name
+
+  input(s):   (block) Block, or (name) string, or lists of them
+  output(s):  None
+
+  adding blocks appends their states to the end of the global system
+  and patches the connectivity, blocks which already had fluxes with
+  them now treat them as unknowns instead of constants, and only the
+  columns of the blocks involved are regrouped. Removing blocks turns
+  them back into constants for their neighbors, the rest of the system
+  is renumbered, keeping its order, and the sparsity pattern and column
+  groups keep the rows and columns left, which can't conflict any more
+  than they did. Both drop the residual cache
+  """
+  def addBlock(self,block):
+    self.addBlocks([block])
+
+  def addBlocks(self,blocks):
+    names = set([b.name for b in self.b+blocks])
+    if len(names) != len(self.b)+len(blocks):
+      exit("multiple blocks have the same name")
+    self._sync()
+    start = len(self.b)
+    self.b.extend(blocks)
+    for i in range(start,len(self.b)):
+      self._index[id(self.b[i])] = i
+      self._versions.append(self.b[i].version)
+      self._dependents.append(set())
+    recolor = set()
+    for i in range(start,len(self.b)):
+      self._neighbors.append(self._coupled(i))
+      for j in self._neighbors[i]:
+        self._dependents[j].add(i)
+      recolor |= self._neighbors[i]
+    # blocks already in the problem with fluxes to the new ones
+    for j,b in enumerate(self.b[:start]):
+      added = set([self._index[id(F.N)] for F in b.F \
+        if self._index.get(id(F.N),-1) >= start])
+      if added:
+        self._neighbors[j] |= added
+        for i in added:
+          self._dependents[i].add(j)
+        recolor |= self._neighbors[j]
+        self._dirty.add(j)
+    for b in blocks:
+      self._mapping += [(self._index[id(b)], k) for k in b.state.keys()]
+      self._offset.append(self._offset[-1]+len(b.state))
+    self._pattern = None
+    self._band = None
+    self._U = None
+    if self._colors is not None:
+      self._colors = concatenate((self._colors,
+        -ones(self._offset[-1]-len(self._colors),int)))
+      self._recolor(recolor)
+    self.version += 1
+
+  def removeBlock(self,name):
+    self.removeBlocks([name])
+
+  def removeBlocks(self,names):
+    names = set(names)
+    self._sync()
+    keep = [i for i,b in enumerate(self.b) if b.name not in names]
+    if len(keep) == len(self.b):
+      return
+    new = dict((i,n) for n,i in enumerate(keep))
+    for i in range(len(self.b)):
+      if i not in new:
+        for j in self._dependents[i]:
+          self._dirty.add(j)
+    columns = [ix for ix,(i,k) in enumerate(self._mapping) if i in new]
+    self.b = [self.b[i] for i in keep]
+    self._index = dict((id(b),i) for i,b in enumerate(self.b))
+    self._versions = [self._versions[i] for i in keep]
+    self._neighbors = [set([new[j] for j in self._neighbors[i] if j in new]) \
+      for i in keep]
+    self._dependents = [set([new[j] for j in self._dependents[i] \
+      if j in new]) for i in keep]
+    self._dirty = set([new[i] for i in self._dirty if i in new])
+    self._mapping = [(new[i],k) for i,k in self._mapping if i in new]
+    self._offset = [0]
+    for b in self.b:
+      self._offset.append(self._offset[-1]+len(b.state))
+    if self._pattern is not None:
+      self._pattern = self._pattern[columns,:][:,columns]
+    if self._colors is not None:
+      self._colors = self._colors[columns]
+    self._band = None
+    self._U = None
+    self.version += 1
   """
   __repr__    overloading for print command
 
@@ -73,6 +297,9 @@ class Problem(object):
     return self.b[key]
   def __setitem__(self, key, value):
     self.b[key] = value
+    self._band = None
+    self._build()
+    self.version += 1
 
   """
   setBand:    sets the bandedness of fsolve (see fsolve help)
@@ -88,8 +315,12 @@ class Problem(object):
 
   input(s):   (solution) global array of floats corresponding to mapping
   output(s):  None
+
+  this sets every state, so the residual cache is dropped
   """     
   def update(self,solution):
+    self._sync()
+    self._U = None
     for ix, (i,k) in enumerate(self.mapping):
       self.b[i][k] = solution[ix]
     for bc in self.bc:
@@ -98,14 +329,75 @@ class Problem(object):
 
   def updateUnst(self,t):
     for b in self.b + self.bc:  
+      if b.t != t:
+        self._U = None
       b.t = t
 
+  """
+  invalidate: drops the residual cache, and the jacobian kept by solvePTC
+
+  input(s):   None
+  output(s):  None
+
+  needed if parameters are changed by hand between solves, so the next
+  one doesn't start with a stale jacobian, or while one runs (from its
+  callback). States set by hand are noticed by r itself. Solves drop
+  the residual cache when they start, but keep the jacobian
+  """
+  def invalidate(self):
+    self._U = None
+    self._jacobian = None
+
+  """
+  _cache:     starts or ends a solve or jacobian using the residual cache
+
+  input(s):   (on) True when it starts, False when it ends
+  output(s):  None
+
+  these nest, and the cache is dropped when the outermost one starts.
+  Outside of them, r evaluates every block, since parameters may have 
+  been changed by hand since the last call
+  """
+  def _cache(self,on):
+    if on and not self._caching:
+      self._U = None
+    self._caching += 1 if on else -1
+
+  """
+  _boundaryUsers: the blocks with fluxes to each boundary block
+
+  input(s):   None
+  output(s):  dict from id of each boundary block to a set of indices
+
+  rebuilt when the version of the problem changes
+  """
+  def _boundaryUsers(self):
+    if self._users is None or self._users[0] != self.version:
+      users = dict((id(bc),set()) for bc in self.bc)
+      for i,b in enumerate(self.b):
+        for F in b.F:
+          if id(F.N) in users:
+            users[id(F.N)].add(i)
+      self._users = (self.version,users)
+    return self._users[1]
+
   def getSolutionVec(self):
+    self._sync()
     solution = [None]*len(self.mapping)
     for ix, (i,k) in enumerate(self.mapping):
       solution[ix] = self.b[i][k]
     return solution
 
+  """
+  timeVec:    coefficients on the time terms, T, in global order
+
+  input(s):   None
+  output(s):  numpy array of floats corresponding to mapping
+  """
+  def timeVec(self):
+    return array([self.b[i].T(self.b[i])[v] for i,v in self.mapping],\
+      dtype=float)
+
   """
   r:          Global residual function r(solution)
   rVec:       Same as r, but in numpy array format (used elsewhere)
@@ -115,14 +407,128 @@ class Problem(object):
 
   updates solution first, then computes
   should be passed into another function
+
+  within a solve or a finite difference jacobian, the solution and
+  residual are cached, if only some unknowns have changed since the
+  last call, only the blocks depending on them (the blocks themselves 
+  and those with fluxes to them) are recomputed, as well as those with
+  fluxes to boundary blocks whose sources gave new states. States set by
+  anything else since the last call drop the cache. Otherwise every
+  block is recomputed
   """
   def r(self,solution):
-    self.update(solution)
-    return [self.b[i].R()[v] for i,v in self.mapping]
+    start = clocktime.time()
+    self._sync()
+    if not self._caching or self._written != Block.written:
+      self._U = None
+    U = array(solution,dtype=float)
+    if self._U is not None and U.shape == self._U.shape:
+      changed = nonzero(U != self._U)[0]
+    if self._U is None or U.shape != self._U.shape or \
+      2*len(changed) > len(U):
+      self.update(U)
+      R = [b.R() for b in self.b]
+      self._R = array([R[i][v] for i,v in self.mapping],dtype=float)
+    else:
+      dependents = self.dependents()
+      mapping = self._mapping
+      blocks = set(self._dirty)
+      for ix in changed:
+        i,k = mapping[ix]
+        self.b[i][k] = U[ix]
+        blocks.update(dependents[i])
+      users = self._boundaryUsers()
+      for bc in self.bc:
+        for s in bc.state:
+          value = sum([S.source()[s] for S in bc.S])
+          if value != bc[s]:
+            bc[s] = value
+            blocks.update(users.get(id(bc),()))
+      for i in blocks:
+        R = self.b[i].R()
+        for ix in range(self._offset[i],self._offset[i+1]):
+          self._R[ix] = R[mapping[ix][1]]
+    self._U = U
+    self._written = Block.written
+    self._dirty.clear()
+    self._tally('residual',start)
+    return self._R.tolist()
 
   def rVec(self,solution):
     return array(self.r(solution))
 
+  """
+  rBatch:     residuals for many solutions at once
+
+  input(s):   (U) 2D array, one column per global solution vector,
+                if it is float32 the residuals are kept in float32
+              (stiff) None for the full residual, or True or False for
+                the stiff or non-stiff part, see rSplit
+  output(s):  2D array, one column of residuals per column of U
+
+  if every flux and source is vectorized, the blocks are given rows
+  of U as states and the residual is computed in a single pass,
+  otherwise it falls back to looping over columns with rVec.
+  Blocks are returned to their current states afterwards
+  """
+  def rBatch(self,U,stiff=None):
+    dtype = float32 if asarray(U).dtype == float32 else float
+    U = array(U,dtype=dtype).reshape(len(self.mapping),-1)
+    current = self.getSolutionVec()
+    # the blocks are restored even if the budget runs out partway
+    try:
+      if self.vectorized():
+        start = clocktime.time()
+        self.update(U)
+        R = [b.R(stiff) for b in self.b]
+        Rb = zeros(U.shape,dtype=dtype)
+        for ix, (i,k) in enumerate(self.mapping):
+          Rb[ix,:] = R[i][k]
+        self._tally('residual',start,U.shape[1])
+      else:
+        Rb = zeros(U.shape,dtype=dtype)
+        for j in range(U.shape[1]):
+          Rb[:,j] = self.rVec(U[:,j]) if stiff is None else \
+            self.rSplit(U[:,j],stiff)
+    finally:
+      self.update(current)
+    return Rb
+
+  """
+  rSplit:     stiff or non-stiff part of the residual
+  rUnstSplit: unsteady version, divided by T
+
+  input(s):   (solution) global array of floats corresponding to mapping
+              (stiff) True for the stiff fluxes and sources, 
+                False for the rest
+              (t) time to evaluate solution at
+  output(s):  numpy array of the part of the residual
+
+  the two parts add up to r, they aren't cached, used by the
+  IMEX and splitting integrators in integrators.py
+  """
+  def rSplit(self,solution,stiff):
+    start = clocktime.time()
+    self.update(solution)
+    R = [b.R(stiff) for b in self.b]
+    self._tally('residual',start)
+    return array([R[i][v] for i,v in self.mapping],dtype=float)
+
+  def rUnstSplit(self,solution,t,stiff):
+    self.updateUnst(t)
+    self.report(t=t)
+    return self.rSplit(solution,stiff)/self.timeVec()
+
+  """
+  vectorized: whether all fluxes and sources accept array valued states
+
+  input(s):   None
+  output(s):  bool
+  """
+  def vectorized(self):
+    return all([F.vectorized for b in self.b for F in b.F]+\
+      [S.vectorized for b in self.b for S in b.S])
+
   """
   rUnst:      Unsteady version of above
 
@@ -135,19 +541,174 @@ class Problem(object):
   """
   def rUnst(self,solution,t):
     self.updateUnst(t)
-    self.update(solution)
-    return [self.b[i].R()[v]/self.b[i].T(self.b[i])[v] for i,v in self.mapping]
+    self.report(t=t)
+    R = self.r(solution)
+    return [R[ix]/self.b[i].T(self.b[i])[v] \
+      for ix,(i,v) in enumerate(self.mapping)]
 
   """
-  solve:      wrapper for chosen (non)linear solver
+  report:     reports an iteration to the SolveResult of the running solve
+  _tally:     adds the time since start to a phase of the running solve
+  _converged: sets whether the running solve converged
 
-  input(s):   None
+  input(s):   (residual) residual norm, (solution) global solution
+              (t) time reached, for transient solves
+              (phase) 'residual', 'jacobian' or 'linear'
+              (start) clock time the phase started
+              (count) number of evaluations
+              (converged) bool
   output(s):  None
 
-  unwraps blocks, passes into solver, finishes by updating blocks one last time
+  these do nothing outside of solve and solveUnst. The result calls the
+  callback, and raises SolveAborted to stop the solve, see result.py
   """
-  def solve(self,t=0):
-    solution = fsolve(self.r,self.getSolutionVec(),band=self._band)
+  def report(self,residual=None,solution=None,t=None):
+    if self._result is not None:
+      self._result.iteration(residual,solution,t)
+
+  def _tally(self,phase,start,count=1):
+    if self._result is not None:
+      self._result.tally(phase,clocktime.time()-start,count)
+
+  def _converged(self,converged):
+    if self._result is not None:
+      self._result.success = bool(converged)
+
+  """
+  solve:      wrapper for chosen (non)linear solver
+
+  input(s):   (method) 'fsolve' (default), 'ptc', pseudo-transient,
+                or 'multigrid'
+              (maxiter) iteration budget, fsolve counts residual
+                evaluations, defaults to the solver's own
+              (maxtime) wall time budget in seconds
+              (callback) function of the SolveResult, called every 
+                iteration (every residual for fsolve), returning True
+                stops the solve
+              (options) passed on to the chosen solver
+  output(s):  SolveResult, see result.py
+
+  unwraps blocks, passes into solver, finishes by updating blocks one last 
+  time with the final solution. Solves stopped early finish with the
+  solution with the smallest residual seen, or the initial one if
+  they were stopped before any. fsolve doesn't report its jacobians,
+  they are counted as residuals, see result.py
+  """
+  def solve(self,t=0,method='fsolve',maxiter=None,maxtime=None,\
+    callback=None,**options):
+    result = SolveResult(method,maxtime,callback)
+    initial = self.getSolutionVec()
+    self._result = result
+    self._cache(True)
+    try:
+      if method == 'fsolve':
+        def f(U):
+          R = self.r(U)
+          self.report(norm(R),U)
+          return R
+        if maxiter is not None:
+          options['maxfev'] = maxiter
+        (solution,info,ier,message) = fsolve(f,self.getSolutionVec(),\
+          band=self._band,full_output=True,**options)
+        (result.status,result.success,result.message) = (ier,ier == 1,message)
+      else:
+        if maxiter is not None:
+          options['maxiter'] = maxiter
+        if method == 'ptc':
+          self.solvePTC(**options)
+        elif method == 'multigrid':
+          self.solveMultigrid(**options)
+        else:
+          exit("unknown solve method "+str(method))
+        solution = self.getSolutionVec()
+    except SolveAborted as e:
+      result.abort(e)
+      # the blocks may be partway through an evaluation, so this
+      # falls back on the initial solution, not their states
+      solution = result.best if result.best is not None else initial
+    finally:
+      self._result = None
+      self._cache(False)
+    self.update(solution)
+    result.finish(solution,norm(self.rVec(solution)))
+    return result
+
+  """
+  solvePTC:   pseudo-transient continuation for hard steady problems
+
+  input(s):   (dt) initial pseudo timestep
+              (tol) residual norm to converge to
+              (maxiter) maximum number of pseudo timesteps
+              (dtmax) largest pseudo timestep allowed
+              (jacobianAge) number of steps a jacobian is reused for
+              (precision) 'double', or 'single' to store and factor the
+                jacobian in float32
+              (refine) number of iterative refinement sweeps of each 
+                single precision linear solve
+  output(s):  list of residual norms, one per accepted step
+
+  marches T dU/dtau = R(U) with implicit euler steps,
+  (T/dtau - J) dU = R(U), growing dtau by switched evolution relaxation,
+  dtau_k+1 = dtau_k*|R_k-1|/|R_k|, so it ends up taking newton steps.
+  The sparse jacobian is reused for jacobianAge steps, and refreshed 
+  whenever a step is rejected. The last one is kept, and the next solve
+  starts with it, unless the topology has changed or invalidate was 
+  called (as it should be after changing parameters). A stale jacobian
+  only slows the solve down, the residuals are always exact.
+  In single precision, the jacobian and its factors take half the
+  memory, the residuals stay in double precision, and each correction
+  is refined in double precision against the single precision matrix,
+  dU = dU + A^-1 (R - A dU), so the solution is as accurate as in
+  double precision, only the jacobian is less accurate
+  """
+  def solvePTC(self,dt=1.,tol=1e-8,maxiter=200,dtmax=1e12,jacobianAge=5,\
+    precision='double',refine=2):
+    dtype = {'double':float,'single':float32}.get(precision)
+    if dtype is None:
+      exit("unknown precision "+str(precision))
+    self._U = None
+    U = array(self.getSolutionVec(),dtype=float)
+    R = self.rVec(U)
+    self.residuals = [norm(R)]
+    (J,age) = (None,0)
+    if self._jacobian is not None and \
+      self._jacobian[:2] == (self.version,precision):
+      J = self._jacobian[2]
+    for k in range(maxiter):
+      if self.residuals[-1] < tol:
+        break
+      if J is None or age >= jacobianAge:
+        J = self.jacobianFD(U,R,dtype=dtype)
+        age = 0
+      self.update(U)
+      A = (diags(self.timeVec().astype(dtype),0)/dtype(dt) - J).tocsc()
+      start = clocktime.time()
+      if dtype == float:
+        Unew = U + spsolve(A,R)
+      else:
+        solve = factorized(A)
+        dU = solve(R.astype(float32)).astype(float)
+        for sweep in range(refine):
+          dU += solve((R-A.dot(dU)).astype(float32))
+        Unew = U + dU
+      self._tally('linear',start,0)
+      Rnew = self.rVec(Unew)
+      rnorm = norm(Rnew)
+      age += 1
+      # reject steps that blow up, shrink the step and get a new jacobian
+      if not isfinite(rnorm) or rnorm > 10.*self.residuals[-1]:
+        dt = dt/10.
+        J = None
+        continue
+      dt = dtmax if rnorm*dtmax <= dt*self.residuals[-1] else \
+        dt*self.residuals[-1]/rnorm
+      U, R = Unew, Rnew
+      self.residuals.append(rnorm)
+      self.report(rnorm,U)
+    self._jacobian = (self.version,precision,J) if J is not None else None
+    self.update(U)
+    self._converged(self.residuals[-1] < tol)
+    return self.residuals
 
   """
   jacobian:   computes numerical jacobian at a given solution
@@ -163,28 +724,340 @@ class Problem(object):
     Jfun = nd.Jacobian(self.rVec)
     return Jfun(self.getSolutionVec())
 
+  """
+  solveMultigrid: FAS multigrid, for grid structured problems
+
+  input(s):   (coarsest, maxLevels) passed on to build the Multigrid
+              (options) passed on to Multigrid.solve
+  output(s):  list of residual norms, one per V-cycle
+
+  the hierarchy of levels is kept, and reused until the topology changes
+  see multigrid.py
+  """
+  def solveMultigrid(self,coarsest=16,maxLevels=10,**options):
+    self._U = None
+    self._sync()
+    if self._multigrid is None or self._multigrid.version != self.version:
+      self._multigrid = Multigrid(self,coarsest,maxLevels)
+    self.residuals = self._multigrid.solve(**options)
+    self._converged(self._multigrid.converged)
+    return self.residuals
+
+  """
+  sparsity:   sparsity pattern of the global jacobian
+
+  input(s):   None
+  output(s):  scipy.sparse csc matrix, ones where dR_i/dU_j can be nonzero
+
+  each block's residual depends on its own states and the states
+  of the neighbors it has fluxes with, neighbors that are not 
+  in the problem (boundaries) are constants and are skipped
+  """
+  def sparsity(self):
+    self._sync()
+    if self._pattern is None:
+      rows, cols = [], []
+      for i,coupled in enumerate(self._neighbors):
+        for r in range(self._offset[i],self._offset[i+1]):
+          for j in coupled:
+            for c in range(self._offset[j],self._offset[j+1]):
+              rows.append(r)
+              cols.append(c)
+      n = len(self.mapping)
+      self._pattern = csc_matrix((ones(len(rows)),(rows,cols)),shape=(n,n))
+    return self._pattern
+
+  """
+  dependents: reverse flux adjacency
+
+  input(s):   None
+  output(s):  list, for each block index, the set of indices of blocks
+              whose residual depends on that block, including itself
+  """
+  def dependents(self):
+    self._sync()
+    return self._dependents
+
+  """
+  colors:     groups of columns which share no rows in the sparsity pattern
+
+  input(s):   None
+  output(s):  numpy array, group number of each column
+
+  greedy coloring, columns in a group can be perturbed together
+  when computing a finite difference jacobian. 
+  _recolor only regroups columns of the given blocks which conflict,
+  so it is used to patch the groups when the fluxes change
+  """
+  def colors(self):
+    self._sync()
+    if self._colors is None:
+      self._colors = -ones(len(self.mapping),dtype=int)
+      self._recolor(range(len(self.b)))
+    return self._colors
+
+  def _recolor(self,blocks):
+    for j in blocks:
+      conflicts = set()
+      for r in self._dependents[j]:
+        conflicts |= self._neighbors[r]
+      columns = [x for k in conflicts \
+        for x in range(self._offset[k],self._offset[k+1])]
+      for c in range(self._offset[j],self._offset[j+1]):
+        used = set(self._colors[[x for x in columns if x != c]])
+        if self._colors[c] < 0 or self._colors[c] in used:
+          color = 0
+          while color in used:
+            color += 1
+          self._colors[c] = color
+
+  """
+  jacobianFD: sparse finite difference jacobian
+
+  input(s):   (solution) global array of floats, defaults to current state
+              (R) residual at solution, if already known
+              (stiff) None for the full jacobian, or True or False for
+                the jacobian of the stiff or non-stiff part, see rSplit
+              (dtype) float, or float32 to store the jacobian, and 
+                evaluate the residuals for it, in single precision
+  output(s):  scipy.sparse csc matrix
+
+  one residual evaluation per column group, rather than per unknown,
+  all groups are evaluated together with rBatch
+  blocks are left at solution afterwards. The jacobian of part of the
+  residual drops the entries of the fluxes in the other part.
+  In single precision, R is not used, the residual at solution is 
+  evaluated in the same batch, so the differences are consistent
+  """
+  def jacobianFD(self,solution=None,R=None,stiff=None,dtype=float):
+    start = clocktime.time()
+    self._cache(True)
+    try:
+      if solution is None:
+        solution = self.getSolutionVec()
+      U = array(solution,dtype=float)
+      single = dtype == float32
+      if R is None and not single:
+        R = self.rVec(U) if stiff is None else self.rSplit(U,stiff)
+      S = self.sparsity()
+      colors = self.colors()
+      Us = U.astype(dtype)
+      h = (finfo(dtype).eps**0.5*maximum(absolute(Us),1.)).astype(dtype)
+      h = (Us+h)-Us
+      ncolors = colors.max()+1 if len(colors) else 0
+      Up = Us.reshape(-1,1).repeat(ncolors+single,axis=1)
+      Up[range(len(U)),colors] += h
+      if single:
+        Rb = self.rBatch(Up,stiff)
+        dR = Rb[:,:-1]-Rb[:,-1:]
+      else:
+        dR = self.rBatch(Up,stiff)-array(R).reshape(-1,1)
+      rows, cols, vals = [], [], []
+      for j in range(len(U)):
+        rj = S.indices[S.indptr[j]:S.indptr[j+1]]
+        rows.extend(rj)
+        cols.extend([j]*len(rj))
+        vals.extend(dR[rj,colors[j]]/h[j])
+      self.update(U)
+      n = len(self.mapping)
+      J = csc_matrix((vals,(rows,cols)),shape=(n,n),dtype=dtype)
+      if stiff is not None:
+        J.eliminate_zeros()
+      self._tally('jacobian',start)
+    finally:
+      self._cache(False)
+    return J
+
+  """
+  _parameterOwners: where each parameter dictionary is used
+
+  input(s):   None
+  output(s):  OrderedDict, from id of each dictionary to
+              (dictionary, indices of blocks whose residuals use it,
+              boundary blocks whose states come from sources using it)
+
+  a block's residual uses its own parameters (.p), those of its
+  fluxes and sources (.P) and of the blocks its fluxes connect to,
+  dictionaries shared between blocks, fluxes and sources appear once
+  """
+  def _parameterOwners(self):
+    owners = OrderedDict()
+    def own(P,i,bc=None):
+      if isinstance(P,dict):
+        (P,blocks,bcs) = owners.setdefault(id(P),(P,set(),[]))
+        blocks.add(i)
+        if bc is not None and all([bc is not C for C in bcs]):
+          bcs.append(bc)
+    boundaries = set([id(bc) for bc in self.bc])
+    for i,B in enumerate(self.b):
+      own(B.p,i)
+      for S in B.S:
+        own(S.P,i)
+      for F in B.F:
+        own(F.P,i)
+        own(F.N.p,i)
+        if id(F.N) in boundaries:
+          for S in F.N.S:
+            own(S.P,i,F.N)
+    return owners
+
+  """
+  parameters: numerical parameters the residual depends on
+
+  input(s):   None
+  output(s):  list of (dictionary, key) pairs
+
+  every int or float entry in the parameters of the blocks, their fluxes
+  and sources, and the sources of boundary blocks, in the order used
+  by sensitivity
+  """
+  def parameters(self):
+    self._sync()
+    parameters = []
+    for (P,blocks,bcs) in self._parameterOwners().values():
+      for key in sorted(P.keys()):
+        if isinstance(P[key],(int,float)) and not isinstance(P[key],bool):
+          parameters.append((P,key))
+    return parameters
+
+  """
+  sensitivity: gradient of an objective of the solved states
+               with respect to parameters, by the discrete adjoint
+
+  input(s):   (objective) function of the global solution, J(U)
+              (parameters) list of (dictionary, key) pairs,
+                defaults to all of them, see parameters
+              (gradient) function returning dJ/dU, if not given
+                it is found by finite differences of the objective
+              (h) relative finite difference step
+  output(s):  list of dJ/dp, one per parameter
+
+  should be called with the blocks at the solution. With R(U,p) = 0,
+  dJ/dp = -lambda^T dR/dp, where J^T lambda = dJ/dU (J the jacobian),
+  so there is one linear solve, and each parameter only needs the
+  residuals of the blocks using it, by central differences
+  """
+  def sensitivity(self,objective,parameters=None,gradient=None,h=1e-6):
+    self._sync()
+    self._U = None
+    U = array(self.getSolutionVec(),dtype=float)
+    R = self.rVec(U)
+    if gradient is not None:
+      g = array(gradient(U),dtype=float)
+    else:
+      g = zeros(len(U))
+      for ix in range(len(U)):
+        du = h*max(abs(U[ix]),1.)
+        (Up,Um) = (U.copy(),U.copy())
+        Up[ix] += du
+        Um[ix] -= du
+        g[ix] = (objective(Up)-objective(Um))/(2*du)
+    lam = spsolve(self.jacobianFD(U,R).T.tocsc(),g)
+    owners = self._parameterOwners()
+    if parameters is None:
+      parameters = self.parameters()
+    self.update(U)
+    dJ = []
+    for (P,key) in parameters:
+      (P,blocks,bcs) = owners.get(id(P),(P,set(),[]))
+      p0 = P[key]
+      dp = h*max(abs(p0),1.)
+      dR = {}
+      # perturb up, down, then restore, boundaries follow their sources
+      for sign in [1,-1,0]:
+        P[key] = p0+sign*dp if sign else p0
+        for bc in bcs:
+          for s in bc.state:
+            bc[s] = sum([S.source()[s] for S in bc.S])
+        if sign == 0:
+          break
+        for i in blocks:
+          Ri = self.b[i].R()
+          for ix in range(self._offset[i],self._offset[i+1]):
+            dR[ix] = dR.get(ix,0.)+sign*Ri[self.mapping[ix][1]]
+      dJ.append(-sum([lam[ix]*dR[ix] for ix in dR])/(2*dp))
+    self.update(U)
+    self._U = None
+    return dJ
+
+  """
+  propagate:  integrate the transient problem from given states with odeint
+
+  input(s):   (solution) global array of states at t[0]
+              (t) times to return the states at
+              (hmax) largest step, defaults to the spacing of t
+  output(s):  2D array of states at each time in t
+
+  doesn't update the blocks, used by solveUnst and the fine
+  propagator of parareal
+  """
+  def propagate(self,solution,t,hmax=None):
+    if hmax is None:
+      hmax = (t[-1]-t[0])/len(t)
+    return odeint(self.rUnst, solution, t,hmax=hmax, \
+      rtol = 1e-4, atol = 1e-4)
+
   """
   solveUnst:  solve the transient problem
 
-  input(s):   (ti) initial time
-              (tf) final time
-              (n)  number of timesteps
-  output(s):  Solution at each timestep
+  input(s):   (t) times to return the solution at
+              (method) 'odeint', 'parareal' to integrate slices of t
+                in parallel, 'imex' or 'strang' to treat non-stiff
+                fluxes and sources explicitly, or 'multirate' to step
+                fast blocks more often than slow ones, see integrators.py
+              (maxiter) iteration budget, in evaluations of the
+                unsteady residual
+              (maxtime) wall time budget in seconds
+              (callback) function of the SolveResult, called at every
+                evaluation of the unsteady residual, returning True 
+                stops the solve
+              (options) passed to the integrator in integrators.py,
+                or to propagate for odeint
+  output(s):  SolveResult, with the solution at each timestep in .states
 
   unwraps blocks, passes into solver, finishes by updating blocks one last time
+  solves stopped early leave the blocks at the last states evaluated,
+  at the time .t of the result, and have no .states
+  For parareal, only the evaluations in this process count towards
+  the budgets and .nfev, and call the callback, the fine propagators
+  in the process pool aren't seen, see integrators.py
   """
-  def solveUnst(self,t):
+  def solveUnst(self,t,method='odeint',maxiter=None,maxtime=None,\
+    callback=None,**options):
+    result = SolveResult(method,maxtime,callback,maxiter)
     solution = [None]*len(self.mapping)
     # This has the unsteady part
     # Solver, just live and let live  
     for ix, (i,k) in enumerate(self.mapping):
       solution[ix] = self.b[i][k]
-    soln = odeint(self.rUnst, solution, t,hmax=(t[-1]-t[0])/len(t), \
-      rtol = 1e-4, atol = 1e-4)
+    self._result = result
+    self._cache(True)
+    try:
+      if method == 'odeint':
+        soln = self.propagate(solution,t,**options)
+      elif method == 'parareal':
+        soln = parareal(self,t,**options)
+      elif method == 'imex':
+        soln = imex(self,t,**options)
+      elif method == 'strang':
+        soln = strang(self,t,**options)
+      elif method == 'multirate':
+        soln = multirate(self,t,**options)
+      else:
+        exit("unknown transient method "+str(method))
+    except SolveAborted as e:
+      result.abort(e)
+      result.finish(self.getSolutionVec())
+      return result
+    finally:
+      self._result = None
+      self._cache(False)
 
     # final update
     self.updateUnst(t[-1])
     self.update(soln[-1,:])
+    (result.success,result.t) = (True,t[-1])
+    result.message = 'reached final time'
 
     # Lets collect all the steps
     fullSolution = dict([(b.name + '_'+s,[]) for b in self.b for s in b.state])
@@ -192,4 +1065,6 @@ class Problem(object):
       for ix, (i,k) in enumerate(self.mapping):
         fullSolution[self.b[i].name+'_'+k].append(soln[j,ix])
     fullSolution['t'] = t
-    return fullSolution
+    result.states = fullSolution
+    result.finish(soln[-1,:])
+    return result
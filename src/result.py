@@ -0,0 +1,198 @@
+"""
+result.py contains the SolveResult class
+
+A SolveResult is returned by Problem.solve and Problem.solveUnst,
+while a solve runs, the Problem reports its progress to it, so it
+also keeps the budgets and callback of the solve, stopping it early
+by raising SolveAborted.
+
+Each SolveResult has:
+  (.method) the solver used
+  (.success) True if the solver converged (or for transient solves,
+    reached the final time)
+  (.aborted) True if stopped early by the time budget or the callback
+  (.message) how the solve ended
+  (.status) solver specific status, such as fsolve's ier
+  (.solution) final global solution, the blocks are left at it
+  (.residual) norm of the residual at the solution, for steady solves
+  (.residuals) residual norm history, one per iteration, for fsolve
+    (which has no iterations to report) one per residual evaluation
+  (.nit) number of iterations reported, for transient solves one per
+    evaluation of the unsteady residual
+  (.t) time reached, for transient solves
+  (.nfev) number of residual evaluations, each column of a batch counts,
+    only those in this process, so parareal's fine propagators running
+    in a process pool aren't counted, and neither are their iterations
+  (.njev) number of jacobians, fsolve reports none, as it builds its
+    own by finite differences through the residual, so those are
+    counted in .nfev and the 'residual' time instead
+  (.times) wall time in seconds for each phase, 'residual',
+    'jacobian' (including its residual evaluations), 'linear' solves,
+    and the 'total'
+  (.states) for transient solves, a dict of lists of the states of
+    each block at each output time, by block name + '_' + state, and
+    the times in 't', which can also be looked up and iterated over
+    on the result
+  (.best) while solving, the solution with the smallest residual so far
+
+"""
+import time as clocktime
+
+class SolveAborted(Exception):
+  """
+  SolveAborted, raised to stop a solve early, by the time budget or
+  the callback, callbacks can raise it themselves with a message
+  """
+  pass
+
+class SolveResult(object):
+  """
+  SolveResult Class
+
+  __init__:   SolveResult Constructor
+
+  input(s):   (method) name of the solver
+              (maxtime) wall time budget in seconds, None for no limit
+              (callback) function of the SolveResult, called at every
+                iteration, returning True stops the solve
+              (maxiter) iteration budget, None for no limit
+  output(s):  None
+  """
+  def __init__(self,method,maxtime=None,callback=None,maxiter=None):
+    self.method = method
+    self.success = False
+    self.aborted = False
+    self.message = ''
+    self.status = None
+    self.solution = None
+    self.residual = None
+    self.residuals = []
+    self.nit = 0
+    self.t = None
+    self.nfev = 0
+    self.njev = 0
+    self.times = {'residual':0.,'jacobian':0.,'linear':0.,'total':0.}
+    self.states = None
+    self.maxtime = maxtime
+    self.maxiter = maxiter
+    self.callback = callback
+    self.best = None
+    self._start = clocktime.time()
+
+  """
+  elapsed:    wall time since the solve started
+
+  input(s):   None
+  output(s):  seconds
+  """
+  def elapsed(self):
+    return clocktime.time()-self._start
+
+  """
+  tally:      adds to the time and count of a phase
+
+  input(s):   (phase) 'residual', 'jacobian' or 'linear'
+              (seconds) wall time spent
+              (count) number of residual evaluations or jacobians
+  output(s):  None
+
+  raises SolveAborted if the time budget has run out
+  """
+  def tally(self,phase,seconds,count=1):
+    self.times[phase] += seconds
+    if phase == 'residual':
+      self.nfev += count
+    elif phase == 'jacobian':
+      self.njev += count
+    self._budget()
+
+  """
+  iteration:  records an iteration, and calls the callback
+
+  input(s):   (residual) residual norm, None if there isn't one
+              (solution) global solution, the one with the smallest
+                residual is kept, to finish with if the solve is stopped
+              (t) time reached, for transient solves
+  output(s):  None
+
+  raises SolveAborted if the iteration budget is used up, without
+  recording the iteration, if the callback asks to stop, or if the
+  time budget has run out
+  """
+  def iteration(self,residual=None,solution=None,t=None):
+    if self.maxiter is not None and self.nit >= self.maxiter:
+      raise SolveAborted('iteration budget of '+str(self.maxiter)+\
+        ' exceeded')
+    self.nit += 1
+    if residual is not None:
+      self.residuals.append(float(residual))
+      if solution is not None and \
+        (self.best is None or residual <= min(self.residuals)):
+        self.best = list(solution)
+    if t is not None:
+      self.t = t
+    if self.callback is not None and self.callback(self):
+      raise SolveAborted('stopped by callback')
+    self._budget()
+
+  def _budget(self):
+    if self.maxtime is not None and self.elapsed() > self.maxtime:
+      raise SolveAborted('time budget of '+str(self.maxtime)+\
+        ' seconds exceeded')
+
+  """
+  abort:      marks the result as stopped early
+
+  input(s):   (e) the SolveAborted exception
+  output(s):  None
+  """
+  def abort(self,e):
+    self.aborted = True
+    self.success = False
+    self.message = str(e)
+
+  """
+  finish:     records the final solution and total time
+
+  input(s):   (solution) final global solution
+              (residual) its residual norm, None for transient solves
+  output(s):  None
+  """
+  def finish(self,solution,residual=None):
+    self.solution = [float(u) for u in solution]
+    self.residual = residual if residual is None else float(residual)
+    self.best = None
+    self.times['total'] = self.elapsed()
+    if not self.message:
+      self.message = 'converged' if self.success else 'did not converge'
+
+  """
+  These look up the states of transient solves, so the result can
+  be used as the dict of states solveUnst used to return, steady
+  solves have none
+  """
+  def __getitem__(self,key):
+    return self.states[key]
+
+  def __contains__(self,key):
+    return self.states is not None and key in self.states
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def keys(self):
+    return self.states.keys() if self.states is not None else []
+
+  """
+  __repr__
+
+  input(s):   None
+  output(s):  str summary of the solve
+  """
+  def __repr__(self):
+    line = self.method+": "+self.message+", "+str(self.nit)+\
+      " iterations, "+str(self.nfev)+" residuals, "+str(self.njev)+\
+      " jacobians, "+'%.3g' % self.times['total']+" seconds"
+    if self.residual is not None:
+      line += ", residual "+'%.3g' % self.residual
+    return line+"\n"
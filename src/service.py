@@ -0,0 +1,274 @@
+"""
+service.py contains the Service class, a long running solver
+
+Starting a process per solve pays for importing scipy, building the
+blocks and Problem, and starting from a cold initial guess each time.
+A Service keeps built Problems in a least recently used cache, keyed by
+a model ID, so repeated solves of a model reuse its blocks, sparsity
+pattern, colors, multigrid levels and the last jacobian of its
+pseudo-transient solves (see Problem.solvePTC), and start from its last
+solution. Parameter updates drop the jacobian.
+
+Models are built by functions given to the Service, each returning a
+Problem. Clients connect over a unix socket (or a localhost TCP port),
+and send one JSON request per line, getting one JSON reply per line.
+Requests are scheduled over a pool of worker threads, requests for the
+same model wait for each other.
+
+A request is a dictionary with
+  (id) model ID, the key in the cache
+  (model) name of the function to build the model with, if not cached
+  (args) dictionary of arguments to build the model with
+  (updates) list of parameter updates, each a dictionary with
+    (block) block name
+    (flux or source) name of a flux or source of the block, if not given
+      the block's own parameters (.p) are updated
+    (key, value) the parameter and its new value
+  (solution) initial guess, defaults to the last solution
+  (method, options) passed to Problem.solve, options can include
+    budgets, such as maxiter and maxtime
+  (command) 'solve' (default), 'drop' to remove the model from
+    the cache, or 'stats' for the state of the cache
+
+and the reply is a dictionary with
+  (id) model ID
+  (solution) the solution vector
+  (residual) norm of the residual at the solution
+  (success, message, iterations, jacobians) how the solve went, see
+    result.py
+  (cached) whether the model was in the cache
+  (time) seconds spent solving
+or (error) a message, if the request failed
+
+Updating a parameter dictionary shared between blocks, fluxes or
+sources updates it for all of them.
+
+"""
+import json
+import socket
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+try:
+  import SocketServer as socketserver
+except ImportError:
+  import socketserver
+
+"""
+_Handler:   reads requests from a connection, one per line,
+            and writes back the replies
+"""
+class _Handler(socketserver.StreamRequestHandler):
+  def handle(self):
+    for line in iter(self.rfile.readline,b''):
+      if not line.strip():
+        continue
+      try:
+        message = json.loads(line.decode('utf-8'))
+        reply = self.server.service.submit(message)
+      except ValueError as e:
+        reply = {'error':'bad request: '+str(e)}
+      self.wfile.write((json.dumps(reply)+'\n').encode('utf-8'))
+      self.wfile.flush()
+
+class _UnixServer(socketserver.ThreadingMixIn,
+  socketserver.UnixStreamServer):
+  daemon_threads = True
+
+class _TCPServer(socketserver.ThreadingMixIn,socketserver.TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+class Service(object):
+  """
+  Service Class
+
+  __init__:   Service Constructor
+
+  input(s):   (models) dict from model names to functions building a
+                Problem, called with the request's args
+              (size) largest number of Problems kept in the cache
+              (workers) number of worker threads solving requests
+  output(s):  None
+
+  Each Service has:
+    (.models) the model building functions
+    (.cache) OrderedDict from model ID to (Problem, lock),
+      least recently used first
+    (.size) capacity of the cache
+    (.pool) worker threads
+    (.server) the socket server, once started
+  """
+  def __init__(self,models,size=8,workers=4):
+    self.models = models
+    self.cache = OrderedDict()
+    self.size = size
+    self.pool = ThreadPool(workers)
+    self.server = None
+    self._lock = threading.Lock()
+
+  """
+  _problem:   gets a model from the cache, building it if needed
+
+  input(s):   (message) request
+  output(s):  (Problem, lock for the problem, whether it was cached)
+  """
+  def _problem(self,message):
+    key = message['id']
+    with self._lock:
+      if key in self.cache:
+        entry = self.cache.pop(key)
+        self.cache[key] = entry
+        return entry+(True,)
+    if message.get('model') not in self.models:
+      raise KeyError('unknown model '+str(message.get('model')))
+    problem = self.models[message['model']](**message.get('args',{}))
+    with self._lock:
+      # another request may have built it in the meantime
+      if key not in self.cache:
+        self.cache[key] = (problem,threading.Lock())
+      entry = self.cache.pop(key)
+      self.cache[key] = entry
+      while len(self.cache) > self.size:
+        self.cache.popitem(last=False)
+    return entry+(False,)
+
+  """
+  update:     applies parameter updates to a problem
+
+  input(s):   (problem) Problem
+              (updates) list of updates, see the module description
+  output(s):  None
+  """
+  def update(self,problem,updates):
+    blocks = dict((B.name,B) for B in problem.b+problem.bc)
+    for u in updates:
+      if u['block'] not in blocks:
+        raise KeyError('unknown block '+str(u['block']))
+      B = blocks[u['block']]
+      if 'flux' in u:
+        targets = [F.P for F in B.F if F.name == u['flux']]
+      elif 'source' in u:
+        targets = [S.P for S in B.S if S.name == u['source']]
+      else:
+        targets = [B.p]
+      targets = [P for P in targets if P is not None]
+      if not targets:
+        raise KeyError('no parameters to update in block '+str(u['block']))
+      for P in targets:
+        P[u['key']] = u['value']
+    if updates:
+      problem.invalidate()
+
+  """
+  handle:     carries out a request
+
+  input(s):   (message) request dictionary
+  output(s):  reply dictionary
+  """
+  def handle(self,message):
+    try:
+      command = message.get('command','solve')
+      if command == 'stats':
+        with self._lock:
+          return {'models':list(self.cache.keys()),'size':self.size}
+      if command == 'drop':
+        with self._lock:
+          return {'id':message['id'],
+            'dropped':self.cache.pop(message['id'],None) is not None}
+      if command != 'solve':
+        return {'error':'unknown command '+str(command)}
+      (problem,lock,cached) = self._problem(message)
+      with lock:
+        self.update(problem,message.get('updates',[]))
+        if 'solution' in message:
+          problem.update(message['solution'])
+        result = problem.solve(method=message.get('method','fsolve'),
+          **message.get('options',{}))
+        return {'id':message['id'],'solution':result.solution,
+          'residual':result.residual,'success':result.success,
+          'message':result.message,'iterations':result.nit,
+          'jacobians':result.njev,'cached':cached,
+          'time':result.times['total']}
+    # problems report bad input with exit, which has to be caught too,
+    # or the worker dies and the request never gets a reply
+    except (Exception,SystemExit) as e:
+      return {'id':message.get('id'),'error':str(e)}
+
+  """
+  submit:     schedules a request on the worker pool and waits for it
+
+  input(s):   (message) request dictionary
+  output(s):  reply dictionary
+  """
+  def submit(self,message):
+    return self.pool.apply_async(self.handle,(message,)).get()
+
+  """
+  start:      starts listening for clients in a background thread
+  serve:      listens for clients until interrupted
+
+  input(s):   (address) path of a unix socket, or (host, port)
+  output(s):  None
+  """
+  def _listen(self,address):
+    if isinstance(address,str):
+      self.server = _UnixServer(address,_Handler)
+    else:
+      self.server = _TCPServer(tuple(address),_Handler)
+    self.server.service = self
+
+  def start(self,address):
+    self._listen(address)
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+  def serve(self,address):
+    self._listen(address)
+    try:
+      self.server.serve_forever()
+    finally:
+      self.shutdown()
+
+  """
+  shutdown:   stops listening and stops the workers
+
+  input(s):   None
+  output(s):  None
+  """
+  def shutdown(self):
+    if self.server is not None:
+      self.server.shutdown()
+      self.server.server_close()
+      self.server = None
+    self.pool.close()
+    self.pool.join()
+
+"""
+request:    sends requests to a running Service
+
+input(s):   (address) path of a unix socket, or (host, port)
+            (messages) a request dictionary, or a list of them
+output(s):  the reply, or list of replies
+"""
+def request(address,messages):
+  single = isinstance(messages,dict)
+  if single:
+    messages = [messages]
+  if isinstance(address,str):
+    connection = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+  else:
+    connection = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+    address = tuple(address)
+  connection.connect(address)
+  replies = []
+  stream = connection.makefile('rb')
+  try:
+    for message in messages:
+      connection.sendall((json.dumps(message)+'\n').encode('utf-8'))
+      replies.append(json.loads(stream.readline().decode('utf-8')))
+  finally:
+    stream.close()
+    connection.close()
+  return replies[0] if single else replies
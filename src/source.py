@@ -21,6 +21,10 @@ u_source = Source(sourceFunction,{'Constant',5},'u_source')
 
 u.addSource(u_source)
 
+As with fluxes, sources which work with array valued states
+can be flagged with vectorized=True, the commonly used ones below do.
+Like fluxes, sources use __slots__, and can be flagged stiff=False.
+
 """
 
 """ commonly used sources """
@@ -39,13 +43,20 @@ class Source(object):
   input(s):   (s) string corresponding to function name
               (parameters) optional dictionary with arguments for the 
               source functions
+              (name) identifying name
+              (vectorized) True if s works with array valued states
+              (stiff) False if the source can be treated explicitly
   output(s):  None
   """
-  def __init__(self,s,P=None,name=''):
+  __slots__ = ('B','S','P','name','vectorized','stiff')
+
+  def __init__(self,s,P=None,name='',vectorized=False,stiff=True):
     self.B = None
     self.S = s
     self.P = P
     self.name = name
+    self.vectorized = vectorized
+    self.stiff = stiff
 
   """
   The following is a wrapper for flux function choices defined with
@@ -10,15 +10,223 @@ prior to every solve
 
 import poisson2D
 import diffusion2D
+import example
+import relaxation
+import benchmark
 import time as clocktime
+import os
+import tempfile
+import numpy as np
+import src.problem as problem
+import src.service as service
+import src.multigrid as multigrid
+import src.blocks as blocks
+import src.amr as amr
+import src.source as source
+import src.flux as flux
 
 if __name__ == '__main__':
   start = clocktime.time()
   print "running tests ...",
+  # batches of residuals should match one residual at a time, vectorized
+  # or not, and leave the blocks as they were
+  grid = problem.Problem(*benchmark.grid(3))
+  U = np.random.RandomState(0).rand(len(grid.mapping),3)
+  current = grid.getSolutionVec()
+  loop = np.array([grid.rVec(U[:,j]) for j in range(3)]).T
+  grid.update(current)
+  batch = grid.rBatch(U)
+  grid.b[0].F[0].vectorized = False
+  assert abs(batch-loop).max() < 1e-12 and not grid.vectorized() and \
+    abs(grid.rBatch(U)-loop).max() < 1e-12 and \
+    grid.getSolutionVec() == current, \
+    "testing failed problem: batch residual error"
+  # cached residuals, as used within solves and jacobians, should match
+  # full evaluations, also when a state was set by hand since the last
+  # one, or boundary states follow the unknowns (here zero gradient
+  # ghosts), and residuals outside of them should follow parameters
+  grid = problem.Problem(*benchmark.grid(3))
+  U = np.array(grid.getSolutionVec())
+  V = U.copy()
+  V[4] += 1.
+  errors = []
+  for hand in [False,True]:
+    grid._cache(True)
+    grid.r(U)
+    if hand:
+      grid.b[5]['u'] = 50.
+    cached = grid.rVec(V)
+    grid._cache(False)
+    errors.append(abs(cached-grid.rVec(V)).max())
+  before = grid.rVec(V)
+  grid.b[0].F[0].P['d'] *= 2
+  errors.append(abs(grid.rVec(V)-problem.Problem(grid.b,grid.bc).rVec(V)).max())
+  chain = [blocks.Block(str(i),[('u',0.)]) for i in range(4)]
+  for i in [1,2]:
+    for j in [i-1,i+1]:
+      chain[i].addFlux(flux.Flux(chain[j],
+        lambda B,N,P: {'u':N['u']-B['u']},None))
+  for (g,i) in [(0,1),(3,2)]:
+    chain[g].addSource(source.Source(lambda B,P,N=chain[i]: {'u':N['u']},
+      None,'ghost'))
+  J = problem.Problem(chain[1:3],[chain[0],chain[3]]).jacobianFD([1.,5.])
+  assert max(errors) < 1e-12 and abs(grid.rVec(V)-before).max() > 1. and \
+    abs(J.toarray()-[[-1.,1.],[1.,-1.]]).max() < 1e-6, \
+    "testing failed problem: cached residual error"
+  # patching a problem after its blocks change should give the same
+  # mapping and sparsity as building it again, and colors which never
+  # share a row
+  (interior,boundary) = benchmark.grid(4)
+  grid = problem.Problem(interior,boundary)
+  names = [b.name for b in interior]
+  (B,C) = (grid.b[5],grid.b[6])
+  F = B.F[0]
+  changes = [lambda: B.removeFlux(F),lambda: B.addFlux(F),
+    lambda: grid.removeBlock(C.name),lambda: grid.addBlock(C),
+    lambda: grid.removeBlocks([B.name,grid.b[0].name]),
+    lambda: grid.addBlocks([interior[0],B]),
+    lambda: B.__setitem__('w',1.)]
+  patched = []
+  for change in changes:
+    grid.colors()
+    change()
+    fresh = problem.Problem(list(grid.b),boundary)
+    (S,colors) = (grid.sparsity().tocsr(),grid.colors())
+    rows = [colors[S.indices[S.indptr[r]:S.indptr[r+1]]] \
+      for r in range(S.shape[0])]
+    patched.append(grid.mapping == fresh.mapping and \
+      (S != fresh.sparsity()).nnz == 0 and \
+      all([len(set(c)) == len(c) for c in rows]))
+  assert all(patched) and [b.name for b in interior] == names, \
+    "testing failed problem: topology patching error"
   rate = poisson2D.test()
   assert (rate[0] > 2.3 and rate[1] > 2.3), \
     "testing failed poisson2D: solver error"
+  rate = poisson2D.test('ptc')
+  assert (rate[0] > 2.3 and rate[1] > 2.3), \
+    "testing failed poisson2D: pseudo-transient solver error"
+  rate = poisson2D.test('ptc',precision='single')
+  assert (rate[0] > 2.3 and rate[1] > 2.3), \
+    "testing failed poisson2D: single precision jacobian error"
+  rate = poisson2D.test('multigrid')
+  assert (rate[0] > 2.3 and rate[1] > 2.3), \
+    "testing failed poisson2D: multigrid solver error"
+  # coarse levels, and their boundaries, should have one flux per face
+  levels = multigrid.Multigrid(problem.Problem(*benchmark.grid(16))).levels
+  assert len(levels) == 3 and \
+    all([len(B.F) == 4 for level in levels for B in level.b]), \
+    "testing failed multigrid: coarse level fluxes"
+  # adaptive refinement should beat uniform refinement with fewer unknowns
+  error = poisson2D.poisson2D(6,'ptc',2)
+  assert error[1] < poisson2D.poisson2D(12,'ptc')[1], \
+    "testing failed poisson2D: adaptive refinement error"
   rate = diffusion2D.test()
   assert (rate[0] > 2.3 and rate[1] > 2.3), \
     "testing failed diffusion2D: solver error"
+  rate = diffusion2D.test('parareal',processes=2)
+  assert (rate[0] > 2.3 and rate[1] > 2.3), \
+    "testing failed diffusion2D: parareal error"
+  rate = diffusion2D.test('imex')
+  assert (rate[0] > 2.3 and rate[1] > 2.3), \
+    "testing failed diffusion2D: IMEX error"
+  # with the decay tagged stiff=False, so only the diffusion is implicit
+  for method in ['imex','strang']:
+    assert relaxation.test(method,nu=1.,stiff=False,dt=1.) > 1.8, \
+      "testing failed relaxation: "+method+" non-stiff source error"
+  rate = diffusion2D.test('multirate')
+  assert (rate[0] > 2.3 and rate[1] > 2.3), \
+    "testing failed diffusion2D: multirate error"
+  # and stay second order when the time scales of the blocks are far apart
+  assert relaxation.test('multirate',fastBlocks=(3,4)) > 1.8, \
+    "testing failed relaxation: multirate coupling error"
+  # adjoint gradients should match finite differences of full solves
+  (adjoint,difference) = example.sensitivities()
+  assert all([abs(a-d) < 1e-6 for a,d in zip(adjoint,difference)]), \
+    "testing failed example: adjoint sensitivity error"
+  # blocks, fluxes and sources should stay compact
+  assert benchmark.benchmark(8)['memory'] < 4000, \
+    "testing failed benchmark: memory per cell"
+  # states should work as dictionaries
+  state = blocks.Block('state',[('u',1.),('v',2.)]).state
+  copy = state.copy()
+  copy.update({'w':3.})
+  assert state.values() == [1.,2.] and state == {'u':1.,'v':2.} and \
+    dict(state.iteritems()) == dict(state) and copy.pop('w') == 3. and \
+    copy == state and copy is not state, \
+    "testing failed blocks: state dictionary interface"
+  # parameters should only be shared within a problem, and not be
+  # handed out again once they have changed
+  grids = [problem.Problem(*benchmark.grid(4)) for k in range(2)]
+  for grid in grids:
+    amr.refine(grid,grid.b[:4])
+  shared = [set([id(F.P) for B in grid.b+grid.bc for F in B.F]) \
+    for grid in grids]
+  table = {}
+  blocks.internParameters({'d':1.},table)['d'] = 5.
+  assert not shared[0] & shared[1] and \
+    blocks.internParameters({'d':1.},table) == {'d':1.}, \
+    "testing failed amr: shared parameters"
+  # solves should report how they went, and stop when asked to
+  grid = problem.Problem(*benchmark.grid(4))
+  result = grid.solve(method='ptc')
+  assert result.success and result.residual < 1e-8 and result.njev > 0, \
+    "testing failed solve result: convergence report"
+  grid = problem.Problem(*benchmark.grid(4))
+  result = grid.solve(method='ptc',callback=lambda r: r.nit >= 1)
+  assert result.aborted and result.nit == 1 and \
+    grid.getSolutionVec() == result.solution, \
+    "testing failed solve result: early termination"
+  # also when the time budget runs out inside the jacobian, with the
+  # blocks holding a batch of states, here a source only slow on batches
+  def slow(B,P):
+    if np.ndim(B['u']):
+      clocktime.sleep(0.2)
+    return {'u':0.,'v':0.}
+  (interior,boundary) = benchmark.grid(4)
+  interior[0].addSource(source.Source(slow,None,'slow',vectorized=True))
+  grid = problem.Problem(interior,boundary)
+  initial = grid.getSolutionVec()
+  result = grid.solve(method='ptc',maxtime=0.1)
+  assert result.aborted and result.njev == 0 and \
+    result.solution == initial and grid.getSolutionVec() == initial, \
+    "testing failed solve result: budget in the jacobian"
+  # transient solves should stop at their iteration budget, whatever
+  # the integrator, and look like a dict of states when they finish
+  for method in ['odeint','imex','strang','multirate']:
+    result = problem.Problem(*benchmark.grid(4)).solveUnst([0.,0.5,1.],
+      method,maxiter=5)
+    assert result.aborted and result.nit == 5 and 't' not in result, \
+      "testing failed solve result: "+method+" iteration budget"
+  result = problem.Problem(*benchmark.grid(4)).solveUnst([0.,0.5,1.])
+  assert result.success and 't' in result and 'x' not in result and \
+    sorted(result) == sorted(result.keys()) and len(result['t']) == 3, \
+    "testing failed solve result: transient states"
+  # parareal's fine propagators in the process pool aren't counted, so a
+  # budget of the iterations counted without one is just enough
+  runs = []
+  for m in [None,0,-1]:
+    runs.append(problem.Problem(*benchmark.grid(4)).solveUnst(
+      [0.,0.25,0.5,0.75,1.],'parareal',processes=2,
+      maxiter=None if m is None else runs[0].nit+m))
+  assert runs[1].success and runs[1].nit == runs[0].nit and \
+    runs[2].aborted, "testing failed solve result: parareal iteration budget"
+  # a solver service should keep problems, and solve them again warm
+  address = os.path.join(tempfile.mkdtemp(),'solver')
+  solver = service.Service({'grid':lambda N: problem.Problem(*benchmark.grid(N))})
+  solver.start(address)
+  message = {'id':'grid','model':'grid','args':{'N':4},'method':'ptc'}
+  # a warm start reuses the jacobian, a parameter update drops it
+  warm = dict(message,solution=[1.]*32)
+  changed = dict(warm,updates=[{'block':'(0,0)','flux':'','key':'d',
+    'value':0.1}])
+  # bad requests get an error back, and the service carries on
+  bogus = dict(message,method='bogus')
+  replies = service.request(address,[message,warm,changed,bogus,message])
+  solver.shutdown()
+  os.remove(address)
+  assert [r.get('cached') for r in replies[:3]] == [False,True,True] and \
+    all([r['residual'] < 1e-8 for r in replies[:3]+replies[4:]]) and \
+    [r['jacobians'] for r in replies[:3]] == [1,0,1] and \
+    replies[3].get('error') == 'unknown solve method bogus', \
+    "testing failed service: cached solve error"
   print "all passed in", '%.2f' % (clocktime.time()-start),"seconds"
\ No newline at end of file